@@ -77,6 +77,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file, as in production: concurrent runs wait for each other's transactions instead of failing on locked tables of a shared in-memory database
+        'TEST': {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')},
     },
 }
 
@@ -97,4 +99,107 @@ USE_TZ = True
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.7/howto/static-files/
 
-STATIC_URL = '/static/'
\ No newline at end of file
+STATIC_URL = '/static/'
+
+# Scraper
+# Number of threads fetching urls in parallel during Task.run and the maximum number of parallel requests to a single host
+
+IDPSCRAPER_WORKERS = 8
+
+IDPSCRAPER_WORKERS_PER_HOST = 2
+
+# Connection pool shared by all task runs: number of hosts to keep connections to, connections kept per host and whether to use http keep-alive
+
+IDPSCRAPER_POOL_HOSTS = 10
+
+IDPSCRAPER_POOL_PER_HOST = 4
+
+IDPSCRAPER_KEEP_ALIVE = True
+
+# Politeness: requests per second and burst size allowed per host. Hosts can be configured individually, e.g. {"www.immowelt.de": (2, 4)}
+
+IDPSCRAPER_RATE = 3
+
+IDPSCRAPER_BURST = 1
+
+IDPSCRAPER_HOST_RATES = {}
+
+# Retries: attempts per url and exponential backoff in seconds. Only timeouts, connection errors and 5xx/429 responses are retried
+
+IDPSCRAPER_MAX_ATTEMPTS = 4
+
+IDPSCRAPER_BACKOFF = 1
+
+IDPSCRAPER_MAX_BACKOFF = 60
+
+# Circuit breaker: consecutive failures after which the urls of a host are given up and seconds until the host is tried again
+
+IDPSCRAPER_BREAKER_THRESHOLD = 5
+
+IDPSCRAPER_BREAKER_COOLDOWN = 300
+
+# Http cache: directory for revalidatable pages (None disables the cache) and its maximum size in bytes
+
+IDPSCRAPER_HTTP_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'http')
+
+IDPSCRAPER_HTTP_CACHE_SIZE = 256 * 1024 * 1024
+
+# Page store: directory for the compressed sources of fetched pages, which allows reparsing without fetching (None disables the store), and its maximum size in bytes
+
+IDPSCRAPER_PAGE_STORE_DIR = os.path.join(BASE_DIR, 'cache', 'pages')
+
+IDPSCRAPER_PAGE_STORE_SIZE = 1024 * 1024 * 1024
+
+# Volatile page fragments that are ignored when detecting unchanged pages, e.g. csrf tokens and timestamps
+
+IDPSCRAPER_VOLATILE_PATTERNS = [
+    r'<input[^>]+name="[^"]*(csrf|token)[^"]*"[^>]*>',
+    r'<meta[^>]+name="[^"]*(csrf|token)[^"]*"[^>]*>',
+    r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(:\d{2})?',
+]
+
+# Frontier: number of urls claimed and enqueued at once and seconds after which urls of a crashed worker are handed out again
+
+IDPSCRAPER_FRONTIER_BATCH = 500
+
+IDPSCRAPER_FRONTIER_TIMEOUT = 600
+
+# Results: number of results written in one transaction and seconds after which collected results are written anyway
+
+IDPSCRAPER_RESULT_BATCH = 500
+
+IDPSCRAPER_RESULT_INTERVAL = 5
+
+# Exports: number of results read from the database at once
+
+IDPSCRAPER_EXPORT_CHUNK = 2000
+
+# Export cache: directory for exports of unchanged tasks (None disables the cache) and its maximum size in bytes
+
+IDPSCRAPER_EXPORT_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'exports')
+
+IDPSCRAPER_EXPORT_CACHE_SIZE = 512 * 1024 * 1024
+
+# Background runs: number of runs executed in parallel, seconds between progress reports and seconds without heartbeat after which a run is considered crashed
+
+IDPSCRAPER_JOB_WORKERS = 2
+
+IDPSCRAPER_JOB_PROGRESS_INTERVAL = 1
+
+IDPSCRAPER_JOB_TIMEOUT = 600
+
+# Live metrics: seconds over which the events of a run are coalesced into one server-sent event
+
+IDPSCRAPER_EVENTS_INTERVAL = 1
+
+# Url canonicalization: query parameters that are dropped from urls (wildcards allowed)
+
+IDPSCRAPER_TRACKING_PARAMS = ["utm_*", "gclid", "fbclid", "mc_cid", "mc_eid", "_ga"]
+
+# False positive rate of the bloom filters that remember visited urls. A false positive means a url is skipped
+
+IDPSCRAPER_VISITED_ERROR_RATE = 0.0001
+
+# Number of processes parsing fetched pages. With 0, pages are parsed in the thread running the task
+
+IDPSCRAPER_PARSERS = 0
@@ -1,7 +1,12 @@
 from django.contrib import admin
-from idpscraper.models import Task, Result, UrlSelector, Selector
+from idpscraper.models import Task, Result, UrlSelector, Selector, FrontierUrl, Page, Run, ResultChange, TaskStats
 
 admin.site.register(Task)
 admin.site.register(Result)
 admin.site.register(UrlSelector)
-admin.site.register(Selector)
\ No newline at end of file
+admin.site.register(Selector)
+admin.site.register(FrontierUrl)
+admin.site.register(Page)
+admin.site.register(Run)
+admin.site.register(ResultChange)
+admin.site.register(TaskStats)
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import idpscraper.models.result
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApartmentSettings',
+            fields=[
+                ('id', models.TextField(default='global', editable=False, primary_key=True, serialize=False)),
+                ('email_to', models.TextField()),
+                ('email_from', models.TextField()),
+                ('password', models.TextField()),
+                ('smtp_server', models.TextField()),
+                ('smtp_port', models.IntegerField(default=465)),
+                ('fetch_intervall', models.IntegerField(default=60)),
+                ('last_update', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('name', models.TextField(primary_key=True, serialize=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UrlSelector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('selector_name', models.TextField()),
+                ('selector_name2', models.TextField()),
+                ('selector_task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_url_selectors', to='idpscraper.task')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='url_selectors', to='idpscraper.task')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Selector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField()),
+                ('type', models.IntegerField(choices=[(0, 'integer'), (1, 'string'), (2, 'datetime'), (3, 'float')], default=1)),
+                ('xpath', models.TextField()),
+                ('regex', models.TextField()),
+                ('is_key', models.BooleanField(default=False)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='selectors', to='idpscraper.task')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Result',
+            fields=[
+                ('key', models.TextField(primary_key=True, serialize=False)),
+                ('results', picklefield.fields.PickledObjectField(default=idpscraper.models.result.createEmptyDict, editable=False)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='idpscraper.task')),
+            ],
+        ),
+    ]
@@ -0,0 +1,155 @@
+# Generated by Django 4.2.30
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import idpscraper.models.task
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idpscraper', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrontierUrl',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('key', models.TextField()),
+                ('state', models.IntegerField(choices=[(0, 'pending'), (1, 'in-flight'), (2, 'done'), (3, 'failed')], db_index=True, default=0)),
+                ('claimed_at', models.DateTimeField(null=True)),
+                ('worker', models.CharField(blank=True, max_length=32)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Page',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('content_hash', models.CharField(blank=True, max_length=64)),
+                ('fingerprint', models.CharField(blank=True, max_length=64)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ResultChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.TextField(db_index=True)),
+                ('field', models.TextField()),
+                ('old', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('new', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('changed_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Run',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('state', models.IntegerField(choices=[(0, 'queued'), (1, 'running'), (2, 'done'), (3, 'failed'), (4, 'cancelled')], db_index=True, default=2)),
+                ('progress', models.JSONField(default=dict)),
+                ('heartbeat', models.DateTimeField(null=True)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TaskStats',
+            fields=[
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='idpscraper.task')),
+                ('result_count', models.BigIntegerField(default=0)),
+                ('last_run_at', models.DateTimeField(null=True)),
+                ('last_run_duration', models.FloatField(null=True)),
+                ('last_run_state', models.IntegerField(choices=[(0, 'queued'), (1, 'running'), (2, 'done'), (3, 'failed'), (4, 'cancelled')], null=True)),
+                ('last_run_fetched', models.IntegerField(default=0)),
+                ('last_run_failed', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='first_seen',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='last_seen',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='selector',
+            name='indexed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='track_changes',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='version',
+            field=models.BigIntegerField(default=idpscraper.models.task.initial_version),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['task', 'key'], name='idpscraper_result_task_key'),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='idpscraper.task'),
+        ),
+        migrations.AddField(
+            model_name='resultchange',
+            name='run',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='changes', to='idpscraper.run'),
+        ),
+        migrations.AddField(
+            model_name='resultchange',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='idpscraper.task'),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='idpscraper.task'),
+        ),
+        migrations.AddField(
+            model_name='frontierurl',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='frontier', to='idpscraper.task'),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='first_run',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='new_results', to='idpscraper.run'),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='last_run',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='seen_results', to='idpscraper.run'),
+        ),
+        migrations.AddConstraint(
+            model_name='run',
+            constraint=models.UniqueConstraint(condition=models.Q(('state__in', (0, 1))), fields=('task',), name='idpscraper_run_one_active_per_task'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='page',
+            unique_together={('task', 'url')},
+        ),
+        migrations.AddIndex(
+            model_name='frontierurl',
+            index=models.Index(fields=['task', 'url'], name='idpscraper_frontierurl_url'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='frontierurl',
+            unique_together={('task', 'key')},
+        ),
+    ]
@@ -0,0 +1,33 @@
+""" Converts the pickled results into JSON, before the results column becomes a JSON column """
+
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations
+from picklefield.fields import dbsafe_decode
+
+BATCH_SIZE = 500
+
+
+def convert_results(apps, schema_editor):
+    """ Results are read in batches ordered by key, so that no query has more parameters than SQLite allows """
+    with schema_editor.connection.cursor() as cursor:
+        last_key = ""
+        while True:
+            cursor.execute("SELECT key, results FROM idpscraper_result WHERE key > %s ORDER BY key LIMIT %s", [last_key, BATCH_SIZE])
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            last_key = rows[-1][0]
+            rows = [(json.dumps(dbsafe_decode(results), cls=DjangoJSONEncoder), key) for key, results in rows if not results.startswith("{")]  # JSON objects are never valid pickles
+            cursor.executemany("UPDATE idpscraper_result SET results = %s WHERE key = %s", rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idpscraper', '0002_frontier_pages_runs_and_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_results, migrations.RunPython.noop),
+    ]
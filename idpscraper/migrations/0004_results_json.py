@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30
+
+import django.core.serializers.json
+from django.db import migrations, models
+import idpscraper.models.result
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idpscraper', '0003_convert_results'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='result',
+            name='results',
+            field=models.JSONField(default=idpscraper.models.result.createEmptyDict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idpscraper', '0004_results_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='result_keys',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
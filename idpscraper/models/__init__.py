@@ -2,6 +2,12 @@ __author__ = 'Sebastian Hofstetter'
 
 from idpscraper.models.urlselector import UrlSelector
 from idpscraper.models.selector import Selector
+from idpscraper.models.run import Run
 from idpscraper.models.result import Result
+from idpscraper.models.result_change import ResultChange
+from idpscraper.models.task_stats import TaskStats
+from idpscraper.models.frontier_url import FrontierUrl
+from idpscraper.models.page import Page
 from idpscraper.models.task import Task
+from idpscraper.models import result_index  # keeps the indexes of selectors in sync
 from idpscraper.models.apartment_settings import ApartmentSettings
\ No newline at end of file
@@ -0,0 +1,69 @@
+""" Memory compact sets of visited urls """
+__author__ = 'Sebastian Hofstetter'
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    A set of strings with a fixed capacity that uses about 1.2 bytes per item at an error rate of 1%. Membership tests may yield false positives
+    >>> bloom_filter = BloomFilter(capacity=100, error_rate=0.01)
+    >>> bloom_filter.add("http://a"); "http://a" in bloom_filter, "http://b" in bloom_filter
+    (True, False)
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))  # bits
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item: str):
+        """ Bit positions of an item by enhanced double hashing """
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2 + i * i) % self.size for i in range(self.hashes))
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+    def add(self, item: str):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """
+    A bloom filter that grows with its content while keeping the overall false positive rate below `error_rate`.
+    Every new stage doubles the capacity and halves the error rate of the previous one
+    >>> visited = ScalableBloomFilter(error_rate=0.001, capacity=100)
+    >>> for i in range(1000):
+    ...     visited.add("http://a/%s" % i)
+    >>> len(visited.filters), all("http://a/%s" % i in visited for i in range(1000))
+    (4, True)
+    >>> sum("http://b/%s" % i in visited for i in range(10000)) < 50
+    True
+    """
+
+    def __init__(self, error_rate: float=0.0001, capacity: int=10000):
+        self.error_rate = error_rate
+        self.filters = [BloomFilter(capacity, error_rate / 2)]
+
+    def __contains__(self, item: str) -> bool:
+        return any(item in bloom_filter for bloom_filter in self.filters)
+
+    def __len__(self):
+        return sum(bloom_filter.count for bloom_filter in self.filters)
+
+    def add(self, item: str):
+        """ Add an item unless it is already contained """
+        if item in self:
+            return
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * 2, self.error_rate / 2 ** (len(self.filters) + 1))
+            self.filters.append(last)
+        last.add(item)
@@ -0,0 +1,50 @@
+""" Canonical form of urls, so that equivalent urls are fetched only once, and removal of tracking parameters """
+__author__ = 'Sebastian Hofstetter'
+
+import fnmatch
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote_plus
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize(url: str, tracking_params=()) -> str:
+    """
+    Lower cases scheme and host, removes default ports, fragments and tracking parameters and sorts the query parameters.
+    Tracking parameters may contain wildcards. The canonical form identifies an url, but may differ from the request the server expects
+    >>> canonicalize("HTTP://WWW.Immowelt.DE:80/liste?sort=2&geoid=5&utm_source=mail#top", tracking_params=["utm_*"])
+    'http://www.immowelt.de/liste?geoid=5&sort=2'
+    >>> canonicalize("https://example.com:8443/a?b=&a=1")
+    'https://example.com:8443/a?a=1&b='
+    >>> canonicalize("http://[::1]:8080/")
+    'http://[::1]:8080/'
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if ":" in netloc:
+        netloc = "[%s]" % netloc  # IPv6
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += ":%s" % parts.port
+    if parts.username:
+        netloc = "%s@%s" % (parts.username + (":" + parts.password if parts.password else ""), netloc)
+
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not any(fnmatch.fnmatchcase(name, pattern) for pattern in tracking_params)]
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(sorted(query)), ""))
+
+
+def strip_tracking(url: str, tracking_params=()) -> str:
+    """
+    Removes tracking parameters from an url and keeps everything else as it is, e.g. the order and encoding of the other parameters
+    >>> strip_tracking("http://[::1]:8080/liste?geoid=108,109&sort=2&sort=1&flag&utm_source=mail#top", tracking_params=["utm_*"])
+    'http://[::1]:8080/liste?geoid=108,109&sort=2&sort=1&flag#top'
+    >>> strip_tracking("http://a/?utm_source=mail", tracking_params=["utm_*"])
+    'http://a/'
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = "&".join(param for param in parts.query.split("&")
+                     if not any(fnmatch.fnmatchcase(unquote_plus(param.split("=", 1)[0]), pattern) for pattern in tracking_params))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
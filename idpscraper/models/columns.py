@@ -0,0 +1,70 @@
+""" Columnar access to the results of a task for analytics, without creating a Result object per row """
+__author__ = 'Sebastian Hofstetter'
+
+from idpscraper.models import Selector
+from idpscraper.models.parser import SelectorSpec
+from idpscraper.models.result import JsonValue
+
+
+def read(results, specs: 'list[SelectorSpec]', chunk_size: int=2000) -> 'dict[str, list]':
+    """ Reads the values of the given selectors from a queryset of results into one list per selector. Datetimes are kept in ISO format """
+    columns = {spec.name: [] for spec in specs}
+    if not specs:
+        return columns
+    rows = results.values_list(*[JsonValue(spec.name) for spec in specs]).iterator(chunk_size=chunk_size)  # Values are extracted by the database
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            _extend(columns, chunk)
+            chunk = []
+    _extend(columns, chunk)
+    return columns
+
+
+def _extend(columns: dict, rows: list):
+    for column, values in zip(columns.values(), zip(*rows)):
+        column.extend(values)
+
+
+def to_numpy(specs: 'list[SelectorSpec]', columns: 'dict[str, list]') -> dict:
+    """
+    Turns columns into numpy arrays: integers and floats as numbers, datetimes as datetime64 and strings as objects.
+    Integer columns with missing values become floats with nan, missing datetimes become NaT
+    """
+    import numpy  # Analytics support
+
+    arrays = {}
+    for spec in specs:
+        values = columns[spec.name]
+        if spec.type == Selector.INTEGER:
+            arrays[spec.name] = numpy.array(values, dtype="int64" if None not in values else "float64")
+        elif spec.type == Selector.FLOAT:
+            arrays[spec.name] = numpy.array(values, dtype="float64")
+        elif spec.type == Selector.DATETIME:
+            arrays[spec.name] = numpy.array(values, dtype="datetime64[us]")
+        else:
+            arrays[spec.name] = numpy.array(values, dtype=object)
+    return arrays
+
+
+def arrow_schema(specs: 'list[SelectorSpec]'):
+    """ The arrow schema of the given selectors """
+    import pyarrow  # Analytics support
+
+    types = {Selector.INTEGER: pyarrow.int64(), Selector.STRING: pyarrow.string(), Selector.DATETIME: pyarrow.timestamp("us"), Selector.FLOAT: pyarrow.float64()}
+    return pyarrow.schema([(spec.name, types[spec.type]) for spec in specs])
+
+
+def to_arrow(specs: 'list[SelectorSpec]', columns: 'dict[str, list]'):
+    """ Turns columns into an arrow table, whose columns are typed by the selectors """
+    import pyarrow  # Analytics support
+
+    schema = arrow_schema(specs)
+    arrays = []
+    for spec, field in zip(specs, schema):
+        if spec.type == Selector.DATETIME:
+            arrays.append(pyarrow.array(columns[spec.name], type=pyarrow.string()).cast(field.type))  # Parses ISO format
+        else:
+            arrays.append(pyarrow.array(columns[spec.name], type=field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
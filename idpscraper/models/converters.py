@@ -102,3 +102,11 @@ def str2datetime(string: str) -> datetime:
     except:
         logging.error("failed to parse %s as date" % repr(string))
         raise
+
+
+
+def identity(string: str) -> str:
+    return string
+
+
+CASTS = (str2int, identity, str2datetime, str2float)  # Casts of the selector types
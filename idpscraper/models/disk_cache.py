@@ -0,0 +1,96 @@
+""" Size bounded cache of files on disk """
+__author__ = 'Sebastian Hofstetter'
+
+import collections
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class DiskCache:
+    """
+    Stores binary values in files of a directory. If the total size exceeds `max_size` bytes, the least recently used files are evicted
+    >>> cache = DiskCache(tempfile.mkdtemp(), max_size=10)
+    >>> cache.set("a", b"12345"); cache.set("b", b"12345"); cache.get("a")
+    b'12345'
+    >>> cache.set("c", b"12345"); cache.get("a"), cache.get("b"), cache.size
+    (b'12345', None, 10)
+
+    Large values can be written and read as files
+    >>> with cache.writer("d") as f:
+    ...     _ = f.write(b"12345")
+    >>> cache.open("d").read(), cache.open("b")
+    (b'12345', None)
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = sorted((entry.stat().st_mtime_ns, entry.path, entry.stat().st_size) for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith("."))
+        self.sizes = collections.OrderedDict((path, size) for _, path, size in entries)  # path => size, least recently used first
+        self.size = sum(self.sizes.values())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key: str) -> bytes:
+        """ Returns the value of a key or None """
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def open(self, key: str):
+        """ Returns the value of a key as binary file or None """
+        path = self.path(key)
+        try:
+            f = open(path, "rb")
+            os.utime(path)  # mark as recently used, also for the next process
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            if path in self.sizes:
+                self.sizes.move_to_end(path)
+        return f
+
+    def set(self, key: str, data: bytes):
+        """ Stores the value of a key and evicts old entries if necessary """
+        with self.writer(key) as f:
+            f.write(data)
+
+    @contextlib.contextmanager
+    def writer(self, key: str):
+        """ Yields a binary file for the value of a key, which is stored when the block is left without an exception """
+        path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+                size = f.tell()
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)  # atomic, readers never see half written files
+
+        with self.lock:
+            self.size += size - self.sizes.get(path, 0)
+            self.sizes[path] = size
+            self.sizes.move_to_end(path)
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """ Delete least recently used files until the cache fits into its size """
+        while self.size > self.max_size and self.sizes:
+            path, size = self.sizes.popitem(last=False)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
@@ -0,0 +1,129 @@
+""" Live metrics of task runs, streamed to the task page as coalesced server-sent events """
+__author__ = 'Sebastian Hofstetter'
+
+import collections
+import json
+import threading
+import time
+
+
+class RunEvents:
+    """
+    Collects the events of the runs of a task in this process: fetched urls with their latency, errors, results and the frontier size.
+    Recording is cheap: counters plus a bounded buffer of recent events. Readers get the events coalesced per interval (see `Subscription`)
+    >>> events = RunEvents(size=2)
+    >>> subscription = events.subscribe(clock=lambda: 2.0)
+    >>> events.start(run=1)
+    >>> for i in range(3):
+    ...     events.fetched("http://a/%s" % i, latency=0.5)
+    >>> events.error("http://a/3", "timeout: read timed out")
+    >>> events.update(results=7, pending=10)
+    >>> metrics = subscription.poll()
+    >>> metrics["fetched"], metrics["errors"], metrics["results"], metrics["pending"], metrics["latency"]
+    (3, 1, 7, 10, 0.5)
+    >>> metrics["recent"]
+    [{'url': 'http://a/2', 'latency': 0.5}, {'url': 'http://a/3', 'error': 'timeout: read timed out'}]
+    >>> subscription.poll() is None  # Nothing happened since
+    True
+    """
+
+    def __init__(self, size: int=20):
+        self.lock = threading.Lock()
+        self.seq = 0  # Number of recorded events
+        self.recent = collections.deque(maxlen=size)  # (seq, event)
+        self.counters = collections.Counter()  # fetched, errors and latency of all runs
+        self.started = collections.Counter()  # counters at the start of the current run
+        self.gauges = dict(run=None, state="idle", results=0, pending=0)
+
+    def start(self, run=None):
+        with self.lock:
+            self.seq += 1
+            self.started = self.counters.copy()
+            self.gauges.update(run=run, state="running", results=0, pending=0)
+
+    def finish(self, state: str):
+        with self.lock:
+            self.seq += 1
+            self.gauges["state"] = state
+
+    def fetched(self, url: str, latency: float):
+        with self.lock:
+            self.seq += 1
+            self.counters["fetched"] += 1
+            self.counters["latency"] += latency
+            self.recent.append((self.seq, dict(url=url, latency=round(latency, 3))))
+
+    def error(self, url: str, error: str):
+        with self.lock:
+            self.seq += 1
+            self.counters["errors"] += 1
+            self.recent.append((self.seq, dict(url=url, error=error)))
+
+    def update(self, **gauges):
+        """ Sets the number of results or pending urls of the current run """
+        with self.lock:
+            self.seq += 1
+            self.gauges.update(gauges)
+
+    def subscribe(self, clock=time.monotonic) -> 'Subscription':
+        return Subscription(self, clock)
+
+
+class Subscription:
+    """ A reader of the events of a task. Every poll coalesces the events since the last poll into a single metrics dict """
+
+    def __init__(self, events: RunEvents, clock=time.monotonic):
+        self.events = events
+        self.clock = clock
+        with events.lock:
+            self.seq = events.seq
+            self.counters = events.counters.copy()
+        self.initial = True  # The first poll tells the current state
+        self.polled = clock()
+
+    def poll(self) -> dict:
+        """ The metrics since the last poll or None if nothing happened """
+        with self.events.lock:
+            if self.events.seq == self.seq and not self.initial:
+                return None
+            recent = [event for seq, event in self.events.recent if seq > self.seq]
+            counters = self.events.counters.copy()
+            total_fetched = counters["fetched"] - self.events.started["fetched"]
+            metrics = dict(self.events.gauges)
+            self.seq = self.events.seq
+        now = self.clock()
+        fetched = counters["fetched"] - self.counters["fetched"]
+        metrics.update(fetched=fetched, errors=counters["errors"] - self.counters["errors"], total_fetched=total_fetched,
+                       pages_per_sec=round(fetched / max(now - self.polled, 0.001), 2),
+                       latency=round((counters["latency"] - self.counters["latency"]) / fetched, 3) if fetched else None, recent=recent)
+        self.counters = counters
+        self.polled = now
+        self.initial = False
+        return metrics
+
+    def stream(self, interval: float, keepalive: float=15, sleep=time.sleep):
+        """ Yields the metrics as server-sent events every `interval` seconds and a comment, if nothing happened for `keepalive` seconds """
+        quiet = 0
+        while True:
+            metrics = self.poll()
+            if metrics is None:
+                quiet += interval
+                if quiet >= keepalive:
+                    quiet = 0
+                    yield ": keepalive\n\n"
+            else:
+                quiet = 0
+                yield "event: metrics\ndata: %s\n\n" % json.dumps(metrics)
+            sleep(interval)
+
+
+_events = {}
+_lock = threading.Lock()
+
+
+def get(task_name: str) -> RunEvents:
+    """ Returns the process wide events of a task """
+    with _lock:
+        if task_name not in _events:
+            _events[task_name] = RunEvents()
+        return _events[task_name]
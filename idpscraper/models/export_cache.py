@@ -0,0 +1,70 @@
+""" Cache of task exports, which are valid as long as the data version of their task does not change """
+__author__ = 'Sebastian Hofstetter'
+
+import threading
+from idpscraper.models.disk_cache import DiskCache
+
+
+class ExportCache:
+    """
+    Keeps exports on disk, keyed by task, data version and format
+    >>> import tempfile
+    >>> cache = ExportCache(DiskCache(tempfile.mkdtemp(), max_size=1000))
+    >>> b"".join(cache.open("task", 1, "csv", lambda: iter(["a,b\\r\\n", "1,2\\r\\n"])))
+    b'a,b\\r\\n1,2\\r\\n'
+    >>> cache.open("task", 1, "csv", lambda: iter(["changed"])).read()
+    b'a,b\\r\\n1,2\\r\\n'
+    """
+
+    def __init__(self, storage: DiskCache):
+        self.storage = storage
+
+    @staticmethod
+    def key(name: str, version: int, export_format: str) -> str:
+        return "%s\0%s\0%s" % (name, version, export_format)
+
+    def open(self, name: str, version: int, export_format: str, export):
+        """
+        Returns the cached export as binary file. Otherwise calls `export`, which returns either a file or an iterator of chunks.
+        Files are stored and returned, chunks are stored while they are iterated
+        """
+        key = ExportCache.key(name, version, export_format)
+        f = self.storage.open(key)
+        if f is not None:
+            return f
+
+        data = export()
+        if hasattr(data, "read"):
+            with self.storage.writer(key) as cached:
+                while True:
+                    chunk = data.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    cached.write(chunk)
+            data.seek(0)
+            return data
+        return self.tee(key, data)
+
+    def tee(self, key: str, chunks):
+        """ Yields the chunks as bytes and stores them, unless the iteration is aborted """
+        with self.storage.writer(key) as cached:
+            for chunk in chunks:
+                chunk = chunk.encode() if isinstance(chunk, str) else chunk
+                cached.write(chunk)
+                yield chunk
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get() -> ExportCache:
+    """ Returns the process wide export cache or None if IDPSCRAPER_EXPORT_CACHE_DIR is not set """
+    global _cache
+    with _lock:
+        if _cache is None:
+            from django.conf import settings
+            if not settings.IDPSCRAPER_EXPORT_CACHE_DIR:
+                return None
+            _cache = ExportCache(DiskCache(settings.IDPSCRAPER_EXPORT_CACHE_DIR, max_size=settings.IDPSCRAPER_EXPORT_CACHE_SIZE))
+        return _cache
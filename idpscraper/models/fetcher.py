@@ -0,0 +1,157 @@
+""" Concurrent fetch engine that limits the number of parallel requests and the request rate per host """
+__author__ = 'Sebastian Hofstetter'
+
+import collections
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from idpscraper.models.retry import FetchError, classify
+from idpscraper.models.bloom_filter import ScalableBloomFilter
+
+
+def host(url: str) -> str:
+    """
+    Returns the host part of an url, which is the unit for concurrency limits
+    >>> host("http://www.immowelt.de/liste?x=1")
+    'www.immowelt.de'
+    >>> host("HTTPS://WWW.Immowelt.DE:443/")
+    'www.immowelt.de:443'
+    """
+    return urlsplit(url).netloc.lower()
+
+
+class Fetcher:
+    """
+    Executes a fetch function for many urls on a thread pool. Every url is fetched only once, even if it is added multiple times.
+    Hosts can be rate limited by token buckets. Instead of waiting for a throttled host, urls of other hosts are fetched.
+    Failed urls are retried according to a retry policy, unless the circuit breaker of their host is open. Urls that finally failed are collected in `failed`.
+    Besides adding urls, urls can be pulled from a feed, e.g. a persistent frontier, whenever the fetcher runs low on urls.
+    The feed itself is responsible for handing out every url only once. Urls are told apart by their `key`, e.g. their canonical form.
+    >>> fetcher = Fetcher(lambda url: url.upper(), workers=2, per_host=1)
+    >>> fetcher.add(["http://a/1", "http://a/2", "http://b/1", "http://a/1"])
+    >>> len(fetcher)
+    3
+    >>> sorted(fetcher)
+    [('http://a/1', 'HTTP://A/1'), ('http://a/2', 'HTTP://A/2'), ('http://b/1', 'HTTP://B/1')]
+
+    >>> def fetch(url):
+    ...     raise ValueError(url)
+    >>> fetcher = Fetcher(fetch)
+    >>> fetcher.add(["http://a/1"])
+    >>> list(fetcher), fetcher.failed
+    ([], {'http://a/1': FetchError("other: ValueError('http://a/1')")})
+    """
+
+    def __init__(self, fetch, workers: int=8, per_host: int=2, buckets=None, policy=None, breakers=None, feed=None, visited=None, key=None):
+        self.fetch = fetch
+        self.key = key or (lambda url: url)
+        self.workers = workers
+        self.per_host = per_host
+        self.buckets = buckets  # host => TokenBucket, no rate limit if None
+        self.policy = policy  # RetryPolicy, no retries if None
+        self.breakers = breakers  # host => CircuitBreaker, no circuit breaking if None
+        self.feed = feed  # count => up to count new urls
+        self.feed_empty = False
+        self.seen = visited if visited is not None else ScalableBloomFilter()  # urls added so far
+        self.queues = collections.OrderedDict()  # host => urls waiting to be fetched
+        self.active = collections.Counter()  # host => number of running requests
+        self.attempts = collections.Counter()  # url => number of failed attempts
+        self.delayed = []  # heap of (time, url) for urls that wait for their next attempt
+        self.failed = {}  # url => FetchError
+
+    def __len__(self):
+        """ Number of urls that are waiting to be fetched """
+        return sum(len(queue) for queue in self.queues.values()) + len(self.delayed)
+
+    def add(self, urls):
+        """ Schedule urls for fetching. Urls that have been scheduled before are ignored """
+        for url in urls:
+            key = self.key(url)
+            if key not in self.seen:
+                self.seen.add(key)
+                self.queues.setdefault(host(url), collections.deque()).append(url)
+
+    def _pull(self):
+        """ Fetch new urls from the feed. Returns whether there were any """
+        urls = self.feed(self.workers * 4)
+        for url in urls:
+            self.queues.setdefault(host(url), collections.deque()).append(url)
+        return bool(urls)
+
+    def notify(self):
+        """ Tell the fetcher that its feed has new urls """
+        self.feed_empty = False
+
+    def __iter__(self):
+        """ Yields (url, response) tuples in order of completion. Urls can be added while iterating """
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                if self.feed and len(self) < self.workers and not (self.feed_empty and running):
+                    self.feed_empty = not self._pull()
+
+                delay = self._submit(executor, running)
+                if not running:
+                    if delay is None:
+                        return
+                    time.sleep(delay)  # Every waiting host is throttled
+                    continue
+
+                done, _ = wait(running, timeout=delay, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = running.pop(future)
+                    url_host = host(url)
+                    self.active[url_host] -= 1
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        self._failure(url, classify(e))
+                        continue
+                    if self.breakers:
+                        self.breakers(url_host).success()
+                    yield url, response
+
+    def _failure(self, url: str, error: FetchError):
+        """ Schedule the next attempt of a failed url or give up on it """
+        self.attempts[url] += 1
+        if error.retryable and self.breakers:
+            self.breakers(host(url)).failure()
+        if self.policy and self.policy.should_retry(error, self.attempts[url]):
+            heapq.heappush(self.delayed, (time.monotonic() + self.policy.delay(self.attempts[url]), url))
+        else:
+            self.failed[url] = error
+
+    def _submit(self, executor, running) -> float:
+        """
+        Hand out urls round robin over all hosts until either all workers or all hosts are busy or throttled.
+        Returns the seconds until the next throttled host or delayed url is ready again or None if nothing is waiting
+        """
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, url = heapq.heappop(self.delayed)
+            self.queues.setdefault(host(url), collections.deque()).appendleft(url)
+
+        delay = self.delayed[0][0] - now if self.delayed else None
+        submitted = True
+        while submitted and len(running) < self.workers:
+            submitted = False
+            for url_host, queue in list(self.queues.items()):
+                if len(running) >= self.workers:
+                    break
+                if queue and self.breakers and self.breakers(url_host).is_open():
+                    # Do not hammer a failing host. Give up its urls, so that they can be retried later #
+                    while queue:
+                        self.failed[queue.popleft()] = FetchError(FetchError.CIRCUIT_OPEN, url_host)
+                if queue and self.active[url_host] < self.per_host:
+                    wait_time = self.buckets(url_host).acquire() if self.buckets else 0
+                    if wait_time:
+                        delay = wait_time if delay is None else min(delay, wait_time)
+                        continue
+                    url = queue.popleft()
+                    self.active[url_host] += 1
+                    running[executor.submit(self.fetch, url)] = url
+                    submitted = True
+                if not queue:
+                    del self.queues[url_host]
+        return delay
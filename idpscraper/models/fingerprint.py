@@ -0,0 +1,31 @@
+""" Fingerprints of page contents that ignore volatile fragments like csrf tokens and timestamps """
+__author__ = 'Sebastian Hofstetter'
+
+import functools
+import hashlib
+import re
+
+
+@functools.lru_cache(maxsize=None)
+def compile_patterns(patterns: tuple) -> 're.Pattern':
+    """ Combine volatile fragment patterns into a single regular expression """
+    return re.compile("|".join("(?:%s)" % pattern for pattern in patterns), re.IGNORECASE | re.DOTALL) if patterns else None
+
+
+def normalize(html_src: str, patterns: tuple) -> str:
+    """
+    Strips all volatile fragments from a page
+    >>> normalize('<input name="csrf_token" value="a1b2"><p>Miete</p><span>2018-01-05 12:30:01</span>', (r'<input[^>]+csrf[^>]*>', r'\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}:\\d{2}'))
+    '<p>Miete</p><span></span>'
+    """
+    pattern = compile_patterns(tuple(patterns))
+    return pattern.sub("", html_src) if pattern else html_src
+
+
+def fingerprint(html_src: str, salt: str="") -> str:
+    """
+    Returns a hash of a (normalized) page. The salt changes the fingerprint of all pages, e.g. when the selectors of a task have changed
+    >>> fingerprint("<p>Miete</p>") == fingerprint("<p>Miete</p>"), fingerprint("<p>Miete</p>") == fingerprint("<p>Miete</p>", salt="v2")
+    (True, False)
+    """
+    return hashlib.sha256((salt + "\0" + html_src).encode()).hexdigest()
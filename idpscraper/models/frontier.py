@@ -0,0 +1,93 @@
+""" Persistent, resumable crawl frontier that can be shared by multiple workers """
+__author__ = 'Sebastian Hofstetter'
+
+import datetime
+import itertools
+import uuid
+from django.db import transaction
+from django.utils import timezone
+from idpscraper.models import FrontierUrl, Page
+from idpscraper.models.bloom_filter import ScalableBloomFilter
+
+
+class Frontier:
+    """
+    Queue of the urls of a task run that lives in the database. Workers claim batches of pending urls and mark them as done or failed.
+    Urls that stay in flight for longer than `timeout` seconds (e.g. because their worker crashed) are handed out again.
+    Urls are identified by their `key`, e.g. their canonical form, while the urls themselves are fetched.
+    Urls enqueued by this worker are remembered in a bloom filter, so that duplicates do not even reach the database.
+    The results of done urls, collected by a ResultWriter, and their pages are written in the same transaction that marks the urls as done,
+    whenever `batch_size` urls are done or the writer is due
+    """
+
+    def __init__(self, task, batch_size: int=500, timeout: float=600, error_rate: float=0.0001, writer=None, key=lambda url: url):
+        self.task = task
+        self.key = key
+        self.writer = writer
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.seen = ScalableBloomFilter(error_rate=error_rate)
+        self.worker = uuid.uuid4().hex  # Identifies the urls claimed by this worker
+        self.done_urls = []
+        self.pages = []
+
+    @property
+    def urls(self):
+        return FrontierUrl.objects.filter(task=self.task)
+
+    def reset(self, urls):
+        """ Start a new run with the given urls """
+        self.urls.delete()
+        self.enqueue(urls)
+
+    def unfinished(self, others: bool=False) -> bool:
+        """ Whether a run has been interrupted or is still running. With `others`, the urls in flight at this worker are not counted """
+        urls = self.urls.filter(state__in=[FrontierUrl.PENDING, FrontierUrl.IN_FLIGHT])
+        if others:
+            urls = urls.exclude(state=FrontierUrl.IN_FLIGHT, worker=self.worker)
+        return urls.exists()
+
+    def enqueue(self, urls):
+        """ Add urls in batches. Urls that are already part of the run are ignored """
+        urls = ((url, self.key(url)) for url in urls)
+        urls = ((url, key) for url, key in urls if key not in self.seen and not self.seen.add(key))
+        while True:
+            batch = [FrontierUrl(task=self.task, url=url, key=key) for url, key in itertools.islice(urls, self.batch_size)]
+            if not batch:
+                return
+            FrontierUrl.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def claim(self, count: int) -> 'list[str]':
+        """ Marks up to `count` pending urls as in flight and returns them """
+        now = timezone.now()
+        stale = self.urls.filter(state=FrontierUrl.IN_FLIGHT, claimed_at__lt=now - datetime.timedelta(seconds=self.timeout)).exclude(worker=self.worker)
+        claimable = self.urls.filter(state=FrontierUrl.PENDING) | stale
+        ids = list(claimable.values_list("id", flat=True)[:count])
+        claimable.filter(id__in=ids).update(state=FrontierUrl.IN_FLIGHT, claimed_at=now, worker=self.worker)  # Urls claimed by another worker in the meantime are not matched anymore
+        return list(self.urls.filter(id__in=ids, worker=self.worker, state=FrontierUrl.IN_FLIGHT).values_list("url", flat=True))
+
+    def done(self, url: str, page: Page=None):
+        """ Marks an url as done. The state and the fetched `page` are written with the next flush """
+        self.done_urls.append(url)
+        if page:
+            self.pages.append(page)
+        if len(self.done_urls) >= self.batch_size or (self.writer and self.writer.due()):
+            self.flush()
+
+    def release(self):
+        """ Hands the urls claimed by this worker, that are not done, back to the pending urls """
+        self.urls.filter(state=FrontierUrl.IN_FLIGHT, worker=self.worker).update(state=FrontierUrl.PENDING, claimed_at=None, worker="")
+
+    def fail(self, url: str, error: Exception, attempts: int):
+        self.urls.filter(url=url).update(state=FrontierUrl.FAILED, error=str(error), attempts=attempts)
+
+    def flush(self):
+        """ Write the results, pages and states of urls marked as done """
+        with transaction.atomic():
+            if self.writer:
+                self.writer.flush()
+            Page.upsert(self.pages)
+            for i in range(0, len(self.done_urls), self.batch_size):
+                self.urls.filter(url__in=self.done_urls[i:i + self.batch_size]).update(state=FrontierUrl.DONE)
+        self.done_urls = []
+        self.pages = []
@@ -0,0 +1,39 @@
+""" The model for an url in the crawl frontier of a task """
+__author__ = 'Sebastian Hofstetter'
+
+from django.db import models
+
+
+class FrontierUrl(models.Model):
+    """ An url of the current or last run of a task and its state. Failed urls can be fetched again by Task.retry_failed """
+    PENDING = 0
+    IN_FLIGHT = 1
+    DONE = 2
+    FAILED = 3
+    STATE_CHOICES = (
+        (PENDING, "pending"),
+        (IN_FLIGHT, "in-flight"),
+        (DONE, "done"),
+        (FAILED, "failed")
+    )
+
+    task = models.ForeignKey('Task', related_name='frontier', on_delete=models.CASCADE)
+    url = models.TextField()  # as it is fetched
+    key = models.TextField()  # canonical form of the url, which identifies it within the run
+    state = models.IntegerField(choices=STATE_CHOICES, default=PENDING, db_index=True)
+    claimed_at = models.DateTimeField(null=True)
+    worker = models.CharField(max_length=32, blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ("task", "key")
+        indexes = [models.Index(fields=["task", "url"], name="idpscraper_frontierurl_url")]
+
+    def __str__(self):
+        return self.url
+
+    def __repr__(self):
+        fields = ["task_id", "url", "state", "attempts", "error"]
+        fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
+        return "FrontierUrl(%s)" % fields
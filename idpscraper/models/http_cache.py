@@ -0,0 +1,81 @@
+""" Persistent http cache that revalidates pages by conditional get-requests """
+__author__ = 'Sebastian Hofstetter'
+
+import json
+import threading
+from idpscraper.models.disk_cache import DiskCache
+
+
+class CachedResponse:
+    """ Body and validators of a cached response """
+
+    def __init__(self, body: bytes, encoding: str, etag: str=None, last_modified: str=None):
+        self.body = body
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.encoding or "utf-8", errors="replace")
+
+    @property
+    def validators(self) -> dict:
+        """ Request headers that turn a get-request into a conditional one """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class HttpCache:
+    """
+    Caches responses that carry an ETag or Last-Modified header
+    >>> import tempfile, requests
+    >>> cache = HttpCache(DiskCache(tempfile.mkdtemp(), max_size=1000))
+    >>> response = requests.Response()
+    >>> response.status_code, response._content, response.encoding = 200, "Grüße".encode(), "utf-8"
+    >>> cache.store("http://a", response)
+    >>> cache.get("http://a") is None
+    True
+    >>> response.headers["ETag"] = '"v1"'
+    >>> cache.store("http://a", response)
+    >>> cache.get("http://a").validators, cache.get("http://a").text
+    ({'If-None-Match': '"v1"'}, 'Grüße')
+    """
+
+    def __init__(self, storage: DiskCache):
+        self.storage = storage
+
+    def get(self, url: str) -> CachedResponse:
+        data = self.storage.get(url)
+        if data is None:
+            return None
+        meta, body = data.split(b"\n", 1)
+        return CachedResponse(body, **json.loads(meta.decode()))
+
+    def store(self, url: str, response):
+        """ Stores a successful response if it can be revalidated later on """
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            meta = dict(encoding=response.encoding or response.apparent_encoding, etag=etag, last_modified=last_modified)
+            self.storage.set(url, json.dumps(meta).encode() + b"\n" + response.content)
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get() -> HttpCache:
+    """ Returns the process wide http cache or None if IDPSCRAPER_HTTP_CACHE_DIR is not set """
+    global _cache
+    with _lock:
+        if _cache is None:
+            from django.conf import settings
+            if not settings.IDPSCRAPER_HTTP_CACHE_DIR:
+                return None
+            _cache = HttpCache(DiskCache(settings.IDPSCRAPER_HTTP_CACHE_DIR, max_size=settings.IDPSCRAPER_HTTP_CACHE_SIZE))
+        return _cache
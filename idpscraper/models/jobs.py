@@ -0,0 +1,74 @@
+""" In-process worker pool executing task runs in the background """
+__author__ = 'Sebastian Hofstetter'
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.utils import timezone
+from idpscraper.models import Run
+
+
+_queued = set()  # ids of the runs waiting for a worker of this process
+
+
+def submit(task) -> Run:
+    """ Queues a run of a task and returns it. Raises Run.AlreadyRunning if the task has an active run """
+    from django.conf import settings
+    run = Run.begin(task, state=Run.QUEUED, timeout=settings.IDPSCRAPER_JOB_TIMEOUT)
+    with _lock:
+        _queued.add(run.pk)
+    get().submit(execute, run.pk)
+    return run
+
+
+def beat():
+    """ Writes the heartbeat of the runs waiting for a worker, so that waiting for long is not taken for a crash """
+    with _lock:
+        queued = list(_queued)
+    if queued:
+        Run.objects.filter(pk__in=queued, state=Run.QUEUED).update(heartbeat=timezone.now())
+
+
+def _beat_forever(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            beat()
+        except Exception:
+            logging.exception("Failed to beat the queued runs")
+        finally:
+            connection.close()
+
+
+def execute(run_id: int):
+    """ Executes a queued run, unless it has been cancelled in the meantime. A run that fails is marked as failed """
+    with _lock:
+        _queued.discard(run_id)
+    try:
+        if not Run.objects.filter(pk=run_id, state=Run.QUEUED).update(state=Run.RUNNING):
+            logging.info("Run %s is not queued anymore" % run_id)
+            return
+        run = Run.objects.select_related("task").get(pk=run_id)
+        run.task.run(job=run)
+    except Exception as e:
+        logging.exception("Run %s failed" % run_id)
+        Run.objects.filter(pk=run_id, state__in=Run.ACTIVE).update(state=Run.FAILED, error=repr(e), finished_at=timezone.now())  # Unless the run already did
+    finally:
+        connection.close()  # Every worker thread has its own connection
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get() -> ThreadPoolExecutor:
+    """ Returns the process wide worker pool, whose size is IDPSCRAPER_JOB_WORKERS. Its queued runs beat several times per IDPSCRAPER_JOB_TIMEOUT """
+    global _executor
+    with _lock:
+        if _executor is None:
+            from django.conf import settings
+            _executor = ThreadPoolExecutor(max_workers=settings.IDPSCRAPER_JOB_WORKERS, thread_name_prefix="idpscraper-run")
+            threading.Thread(target=_beat_forever, args=(settings.IDPSCRAPER_JOB_TIMEOUT / 4,), name="idpscraper-beat", daemon=True).start()
+        return _executor
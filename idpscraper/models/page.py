@@ -0,0 +1,31 @@
+""" The model for a fetched page of a task """
+__author__ = 'Sebastian Hofstetter'
+
+from django.db import models
+
+
+class Page(models.Model):
+    """ The latest content of an url fetched by a task. The content itself lives in the page store, the fingerprint detects unchanged pages """
+    task = models.ForeignKey('Task', related_name='pages', on_delete=models.CASCADE)
+    url = models.TextField()
+    content_hash = models.CharField(max_length=64, blank=True)
+    fingerprint = models.CharField(max_length=64, blank=True)
+    result_keys = models.JSONField(default=list, blank=True)  # The results parsed from the page, refreshed while the page is unchanged
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("task", "url")
+
+    def __str__(self):
+        return self.url
+
+    def __repr__(self):
+        fields = ["task_id", "url", "content_hash", "fingerprint"]
+        fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
+        return "Page(%s)" % fields
+
+    @staticmethod
+    def upsert(pages: 'list[Page]'):
+        """ Insert or update pages in a single statement, so that concurrent runs do not lock each other out """
+        if pages:
+            Page.objects.bulk_create(pages, update_conflicts=True, unique_fields=["task", "url"], update_fields=["content_hash", "fingerprint", "result_keys", "fetched_at"])
@@ -0,0 +1,54 @@
+""" Content addressed store of compressed raw pages """
+__author__ = 'Sebastian Hofstetter'
+
+import gzip
+import hashlib
+import tempfile
+import threading
+from idpscraper.models.disk_cache import DiskCache
+
+
+class PageStore:
+    """
+    Stores page sources compressed in a DiskCache, keyed by the sha256 hash of their content. Identical pages are stored only once.
+    Pages that have not been stored or read for the longest time are evicted, when the cache is full
+    >>> store = PageStore(DiskCache(tempfile.mkdtemp(), max_size=1000))
+    >>> content_hash = store.put("<html>Grüße</html>")
+    >>> content_hash == store.put("<html>Grüße</html>"), store.get(content_hash), store.get("unknown")
+    (True, '<html>Grüße</html>', None)
+    """
+
+    def __init__(self, storage: DiskCache):
+        self.storage = storage
+
+    def put(self, html_src: str) -> str:
+        """ Stores a page and returns its content hash """
+        data = html_src.encode()
+        content_hash = hashlib.sha256(data).hexdigest()
+        f = self.storage.open(content_hash)  # Marks a stored page as recently used
+        if f is None:
+            self.storage.set(content_hash, gzip.compress(data))
+        else:
+            f.close()
+        return content_hash
+
+    def get(self, content_hash: str) -> str:
+        """ Returns a stored page or None """
+        data = self.storage.get(content_hash)
+        return None if data is None else gzip.decompress(data).decode()
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get() -> PageStore:
+    """ Returns the process wide page store or None if IDPSCRAPER_PAGE_STORE_DIR is not set """
+    global _store
+    with _lock:
+        if _store is None:
+            from django.conf import settings
+            if not settings.IDPSCRAPER_PAGE_STORE_DIR:
+                return None
+            _store = PageStore(DiskCache(settings.IDPSCRAPER_PAGE_STORE_DIR, max_size=settings.IDPSCRAPER_PAGE_STORE_SIZE))
+        return _store
@@ -0,0 +1,220 @@
+""" Evaluation of a task's selectors on html pages, either in the calling thread or in a pool of parser processes """
+__author__ = 'Sebastian Hofstetter'
+
+import collections
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from lxml import html, etree  # xpath support
+from idpscraper import parser_process
+from idpscraper.models import converters
+
+SelectorSpec = collections.namedtuple("SelectorSpec", ["name", "type", "xpath", "regex", "is_key"])
+
+
+# In the following some xpath extension functions are introduced. They can be used in the xpath fields of a task's selectors #
+def textify(node):
+    return (str(node.text) if hasattr(node, "text") else str(node)).strip()
+
+
+def merge_lists(context, *args):
+    """ Merge the items of lists at same positions. If one list is shorter, its last element is repeated """
+    try:
+        return [" ".join([textify(arg[min(i, len(arg) - 1)]) for arg in args]) for i in range(max(map(len, args)))]
+    except Exception as e:
+        return [""]
+
+
+def exe(context, nodes, path):
+    """ Executes a given xpath with each node in the first xpath as context node """
+    try:
+        return [textify(node.xpath(path).pop()) if node.xpath(path) else "" for node in nodes]
+    except Exception as e:
+        return [""]
+
+
+def all(context, nodes):
+    return [" ".join(textify(node) for node in nodes)]
+
+ns = etree.FunctionNamespace(None)
+ns['merge_lists'] = merge_lists
+ns['exe'] = exe
+ns['all'] = all
+
+
+def compile_xpath(spec: SelectorSpec) -> etree.XPath:
+    return etree.XPath(spec.xpath)
+
+
+def compile_regex(spec: SelectorSpec):
+    return re.compile(spec.regex, re.DOTALL | re.UNICODE) if spec.regex else None
+
+
+def validate(spec: SelectorSpec):
+    """
+    Raises a ValueError naming the selector, if its XPath or regular expression cannot be compiled
+    >>> validate(SelectorSpec("id", 0, "//b[", "", True))
+    Traceback (most recent call last):
+    ValueError: Invalid XPath of selector id: Invalid expression
+    >>> validate(SelectorSpec("id", 0, "//b", "(", True))
+    Traceback (most recent call last):
+    ValueError: Invalid regular expression of selector id: missing ), unterminated subpattern at position 0
+    """
+    try:
+        compile_xpath(spec)
+    except etree.XPathSyntaxError as e:
+        raise ValueError("Invalid XPath of selector %s: %s" % (spec.name, e))
+    try:
+        compile_regex(spec)
+    except re.error as e:
+        raise ValueError("Invalid regular expression of selector %s: %s" % (spec.name, e))
+
+
+class SelectorSchema:
+    """
+    The names, keys and types of a task's selectors, as needed by results, tables and exports. Nothing is compiled, so invalid XPaths do not break them
+    >>> schema = SelectorSchema([SelectorSpec("id", 0, "//b[", "", True), SelectorSpec("date", 2, "//i", "", False)])
+    >>> schema.names, schema.key_names, schema.datetime_names
+    (('id', 'date'), ('id',), frozenset({'date'}))
+    """
+
+    def __init__(self, specs: 'list[SelectorSpec]'):
+        self.specs = tuple(specs)
+        self.names = tuple(spec.name for spec in self.specs)
+        self.key_names = tuple(spec.name for spec in self.specs if spec.is_key)
+        self.datetime_names = frozenset(spec.name for spec in self.specs if converters.CASTS[spec.type] is converters.str2datetime)
+        self._plan = None
+
+    def compile(self) -> 'SelectorPlan':
+        """ The selectors compiled for parsing. They are compiled once per schema """
+        if self._plan is None:
+            self._plan = SelectorPlan(self.specs)
+        return self._plan
+
+    def __bool__(self):
+        return bool(self.specs)
+
+    def __repr__(self):
+        return "SelectorSchema(%r)" % (list(self.specs),)
+
+
+class SelectorPlan(SelectorSchema):
+    """
+    Immutable, compiled form of a task's selectors: XPath expressions, regular expressions and casts are prepared once and reused for every page.
+    Plans can be sent to parser processes, where they are compiled again
+    >>> plan = SelectorPlan([SelectorSpec("id", 0, "//b/text()", "", True), SelectorSpec("title", 1, "all(//i)", "", False)])
+    >>> plan.names, plan.key_names
+    (('id', 'title'), ('id',))
+    >>> plan.parse("<p><b>1</b><b>2</b><i>a</i><i>b</i></p>")
+    [{'id': 1, 'title': 'a b'}, {'id': 2, 'title': 'a b'}]
+    """
+
+    def __init__(self, specs: 'list[SelectorSpec]'):
+        super().__init__(specs)
+        self._compile()
+
+    def _compile(self):
+        self.key_indexes = tuple(x for x, spec in enumerate(self.specs) if spec.is_key)
+        self.xpaths = tuple(compile_xpath(spec) for spec in self.specs)
+        self.regexes = tuple(compile_regex(spec) for spec in self.specs)
+        self.casts = tuple(converters.CASTS[spec.type] for spec in self.specs)
+
+    def compile(self) -> 'SelectorPlan':
+        return self
+
+    def __getstate__(self):
+        return self.specs  # Compiled expressions cannot be pickled
+
+    def __setstate__(self, specs):
+        SelectorSchema.__init__(self, specs)
+        self._compile()
+
+    def __repr__(self):
+        return "SelectorPlan(%r)" % (list(self.specs),)
+
+    def parse(self, html_src: str) -> 'list[dict]':
+        """
+        Parses an html document for the XPath expressions of the selectors. Any resulting node can optionally be filtered against a regular expression.
+        Returns one row per result of the key selectors, mapping selector names to casted values
+        """
+        parsed_tree = html.document_fromstring(html_src)
+
+        selectors_results = []
+        for xpath, regex, cast in zip(self.xpaths, self.regexes, self.casts):
+            nodes = [textify(node) for node in xpath(parsed_tree)]
+
+            if regex:
+                # Apply regex to every single node #
+                selector_results = []
+                for node in nodes:
+                    regex_result = regex.search(node)
+                    if regex_result:
+                        if regex_result.groups():
+                            selector_results.append(regex_result.groups()[-1])
+                        else:
+                            selector_results.append(regex_result.group())
+                    else:
+                        selector_results.append(None)
+            else:
+                selector_results = nodes
+
+            selectors_results.append([cast(data) if data is not None else None for data in selector_results])  # cast to type
+
+        # convert selector results from a tuple of lists to a list of rows #
+        count = max([len(selectors_results[x]) for x in self.key_indexes])  # Take as many results, as there are results for a key selector
+        selectors_results = [selector_results or [None] for selector_results in selectors_results]  # Guarantee that an element is there
+        return [{name: selector_results[min(y, len(selector_results) - 1)] for name, selector_results in zip(self.names, selectors_results)} for y in range(count)]
+
+
+class ParserPool:
+    """
+    Parses pages with a selector plan. With `processes`, pages are parsed in a pool of parser processes, otherwise in the calling thread.
+    Parser processes are spawned instead of forked, as forking a process that runs other threads (e.g. further runs) can deadlock.
+    Parsed pages are collected as (key, rows, exception) tuples
+    >>> with ParserPool(SelectorPlan([SelectorSpec("id", 0, "//b/text()", "", True)])) as parsers:
+    ...     parsers.submit("a", "<b>1</b>")
+    ...     parsers.submit("b", "")
+    ...     [(key, rows, type(error).__name__) for key, rows, error in parsers.completed()]
+    [('a', [{'id': 1}], 'NoneType'), ('b', None, 'ParserError')]
+    """
+
+    def __init__(self, plan: SelectorPlan, processes: int=0):
+        self.plan = plan
+        self.processes = processes
+        self.executor = None
+        self.pending = {}  # future => key
+        self.done = []
+
+    def __enter__(self):
+        if self.processes:
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=parser_process.init, initargs=([tuple(spec) for spec in self.plan.specs],))
+        return self
+
+    def __exit__(self, *args):
+        if self.executor:
+            self.executor.shutdown(cancel_futures=True)
+
+    def submit(self, key, html_src: str):
+        """ Parse a page. Blocks while all parser processes are busy with a backlog of pages """
+        if not self.executor:
+            try:
+                self.done.append((key, self.plan.parse(html_src), None))
+            except Exception as e:
+                self.done.append((key, None, e))
+            return
+
+        if len(self.pending) >= self.processes * 4:
+            wait(self.pending, return_when=FIRST_COMPLETED)
+        self.pending[self.executor.submit(parser_process.parse, html_src)] = key
+
+    def completed(self, block: bool=False):
+        """ Yields the pages parsed so far. With `block`, waits for all pending pages """
+        if block:
+            wait(self.pending)
+        for future in [future for future in self.pending if future.done()]:
+            key = self.pending.pop(future)
+            error = future.exception()
+            self.done.append((key, None if error else future.result(), error))
+        done, self.done = self.done, []
+        yield from done
@@ -0,0 +1,51 @@
+""" Per host politeness: token buckets limiting the request rate to every host """
+__author__ = 'Sebastian Hofstetter'
+
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average and bursts of up to `burst` requests
+    >>> now = [0.0]
+    >>> bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+    >>> bucket.acquire(), bucket.acquire(), bucket.acquire()
+    (0, 0, 0.5)
+    >>> now[0] = 0.5
+    >>> bucket.acquire(), bucket.acquire()
+    (0, 0.5)
+    """
+
+    def __init__(self, rate: float, burst: int=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """ Takes a token if one is available and returns 0. Otherwise returns the seconds until the next token is available """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+_buckets = {}
+_lock = threading.Lock()
+
+
+def get(host: str) -> TokenBucket:
+    """ Returns the process wide token bucket of a host. Rates are taken from IDPSCRAPER_HOST_RATES or default to IDPSCRAPER_RATE """
+    with _lock:
+        if host not in _buckets:
+            from django.conf import settings
+            rate, burst = settings.IDPSCRAPER_HOST_RATES.get(host, (settings.IDPSCRAPER_RATE, settings.IDPSCRAPER_BURST))
+            _buckets[host] = TokenBucket(rate=rate, burst=burst)
+        return _buckets[host]
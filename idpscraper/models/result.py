@@ -1,38 +1,89 @@
 """ The model for a task's result """
 __author__ = 'Sebastian Hofstetter'
 
-from django.db import models
-from picklefield.fields import PickledObjectField
+from idpscraper.models.selector import get_schema
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils.dateparse import parse_datetime
 
 
 def createEmptyDict():
     return dict()
 
 
+class JsonValue(models.Func):
+    """
+    The value of a selector in the results column, for filtering results in the database.
+    The path is part of the SQL, so that the expression matches the indexes of indexed selectors, e.g.
+    Result.objects.filter(task=task).alias(price=JsonValue("price")).filter(price__gte=12)
+    """
+    function = "JSON_EXTRACT"
+
+    def __init__(self, name: str, output_field=None):
+        self.name = name
+        super().__init__(models.F("results"), output_field=output_field or models.Field())
+
+    def as_sql(self, compiler, connection, **extra_context):
+        path = '$."%s"' % self.name.replace('"', '\\"')
+        template = "%%(function)s(%%(expressions)s, '%s')" % path.replace("'", "''").replace("%", "%%")
+        return super().as_sql(compiler, connection, template=template, **extra_context)
+
+
 class Result(models.Model):
-    """ Holds results of webscraping executions """
+    """
+    Holds results of webscraping executions. The values of the selectors are kept in a JSON column.
+    Results remember when and by which run they were written first and last
+    """
     key = models.TextField(primary_key=True)
     task = models.ForeignKey('Task', related_name='results',on_delete=models.CASCADE)
-    results = PickledObjectField(default=createEmptyDict)
+    results = models.JSONField(default=createEmptyDict, encoder=DjangoJSONEncoder)
+    first_seen = models.DateTimeField(null=True)
+    last_seen = models.DateTimeField(null=True)
+    first_run = models.ForeignKey('Run', related_name='new_results', null=True, on_delete=models.SET_NULL)
+    last_run = models.ForeignKey('Run', related_name='seen_results', null=True, on_delete=models.SET_NULL)
 
-    def __str__(self):
-        return repr({k: v for k, v in self.__dict__.items() if k not in ["task_id", "_state", "key"]})
+    class Meta:
+        indexes = [models.Index(fields=["task", "key"], name="idpscraper_result_task_key")]  # Pages of the results of a task
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __str__(self):
+        values = {k: getattr(self, k) for k in self.results}
+        values.update({k: v for k, v in self.__dict__.items() if k not in ["task_id", "_state", "key", "results", "first_seen", "last_seen", "first_run_id", "last_run_id"]})
+        return repr(values)
 
-        # set no-sql values to result object from .results dict #
-        for k, v in self.results.items():
-            setattr(self, k, v)
+    def __getattr__(self, name):
+        """ Selector values that have not been set on the result object are read from the .results dict """
+        results = self.__dict__.get("results")
+        if results is None or name not in results:
+            raise AttributeError(name)
+        value = results[name]
+        if isinstance(value, str) and name in get_schema(self.task_id).datetime_names:
+            return parse_datetime(value)  # JSON has no datetime type
+        return value
 
     def save(self, *args, **kwargs):
+        self.pack()
+        with transaction.atomic():
+            self.bump_task_version()
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.bump_task_version()
+            return super().delete(*args, **kwargs)
+
+    def bump_task_version(self):
+        """ Invalidate the cached exports of the result's task """
+        Result._meta.get_field("task").related_model.bump_version(self.task_id)
+
+    def pack(self):
+        """ Prepare the result for writing """
         # set no-sql values from result object to .results dict #
-        self.results = {selector.name: getattr(self, selector.name) for selector in self.task.selectors.all()}
+        self.results = {name: getattr(self, name) for name in get_schema(self.task_id).names}
         if not self.key:
             self.key = self.get_key()
-        super().save(*args, **kwargs)
 
     def get_key(self):
-        if all([getattr(self, selector.name) for selector in self.task.selectors.all() if selector.is_key]):
-            result_id = u" ".join([str(getattr(self, selector.name)) for selector in self.task.selectors.all() if selector.is_key])  # Assemble Result_key from key selectors
-            return self.task.name + result_id
\ No newline at end of file
+        key_names = get_schema(self.task_id).key_names
+        if all([getattr(self, name) for name in key_names]):
+            result_id = u" ".join([str(getattr(self, name)) for name in key_names])  # Assemble Result_key from key selectors
+            return self.task_id + result_id
@@ -0,0 +1,24 @@
+""" The model for a change of a result's value """
+__author__ = 'Sebastian Hofstetter'
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class ResultChange(models.Model):
+    """ A selector value of a result that differs from its previous value. Only recorded for tasks that track changes """
+    task = models.ForeignKey('Task', related_name='changes', on_delete=models.CASCADE)
+    key = models.TextField(db_index=True)  # of the changed result
+    field = models.TextField()
+    old = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    new = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    run = models.ForeignKey('Run', related_name='changes', null=True, on_delete=models.SET_NULL)
+    changed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "%s.%s: %r -> %r" % (self.key, self.field, self.old, self.new)
+
+    def __repr__(self):
+        fields = ["task_id", "key", "field", "old", "new", "run_id", "changed_at"]
+        fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
+        return "ResultChange(%s)" % fields
@@ -0,0 +1,65 @@
+""" Expression indexes on the values of key and indexed selectors in the results column """
+__author__ = 'Sebastian Hofstetter'
+
+import contextlib
+import hashlib
+import logging
+import threading
+from django.db import connection, models
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from idpscraper.models import Selector, Result
+from idpscraper.models.result import JsonValue
+
+PREFIX = "idpscraper_result_json_"
+
+_deferred = threading.local()  # Selector changes of this thread that wait for the end of a deferred block
+
+
+def index(name: str) -> models.Index:
+    """
+    The index on the values of all selectors named `name`. Results are always filtered by task first
+    >>> index("kaltmiete").name
+    'idpscraper_result_json_098c15381d'
+    """
+    return models.Index(models.F("task"), JsonValue(name), name=PREFIX + hashlib.sha1(name.encode()).hexdigest()[:10])
+
+
+def sync():
+    """ Create the indexes of key and indexed selectors and drop the indexes that are not needed anymore """
+    names = Selector.objects.filter(models.Q(is_key=True) | models.Q(indexed=True)).values_list("name", flat=True).distinct()
+    wanted = {i.name: i for i in map(index, names)}
+    schema_editor = connection.schema_editor()  # Only generates the statements, which may run inside transactions
+    with connection.cursor() as cursor:
+        existing = {name for name in connection.introspection.get_constraints(cursor, Result._meta.db_table) if name.startswith(PREFIX)}
+        for name in wanted.keys() - existing:
+            logging.info("Creating index %s" % name)
+            cursor.execute(str(wanted[name].create_sql(Result, schema_editor)))
+        for name in existing - wanted.keys():
+            logging.info("Dropping index %s" % name)
+            cursor.execute(str(models.Index(fields=["task"], name=name).remove_sql(Result, schema_editor)))
+
+
+@contextlib.contextmanager
+def deferred():
+    """ Sync the indexes once at the end of the block instead of after every selector change, e.g. while all selectors of a task are replaced """
+    depth = getattr(_deferred, "depth", 0)
+    _deferred.depth = depth + 1
+    try:
+        yield
+    finally:
+        _deferred.depth = depth
+    if not depth:
+        sync()
+
+
+@receiver([post_save, post_delete], sender=Selector)
+def _selector_changed(sender, instance, **kwargs):
+    if not getattr(_deferred, "depth", 0):
+        sync()
+
+
+@receiver(post_migrate)
+def _migrated(sender, app_config, **kwargs):
+    if app_config.name == "idpscraper":
+        sync()
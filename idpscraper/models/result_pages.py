@@ -0,0 +1,125 @@
+""" Pages of the results of a task with keyset pagination, projection, sorting and filtering in the database """
+__author__ = 'Sebastian Hofstetter'
+
+import base64
+import json
+from django.db.models import F, Q
+from idpscraper.models import Selector
+from idpscraper.models.result import JsonValue
+
+LOOKUPS = ("exact", "gt", "gte", "lt", "lte", "contains", "startswith")
+MAX_LIMIT = 500
+
+
+class InvalidQuery(ValueError):
+    """ Raised for unknown columns, lookups or malformed cursors """
+
+
+def encode_cursor(values: list) -> str:
+    """
+    An opaque cursor for the position after a row
+    >>> decode_cursor(encode_cursor([12.5, "task12"]))
+    [12.5, 'task12']
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, length: int=2) -> list:
+    """
+    The `length` values of a cursor: the sort value, if sorted, and the key of a row
+    >>> decode_cursor(encode_cursor([1]))
+    Traceback (most recent call last):
+    idpscraper.models.result_pages.InvalidQuery: Invalid cursor WzFd
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise InvalidQuery("Invalid cursor %s" % cursor)
+    if not (isinstance(values, list) and len(values) == length and isinstance(values[-1], str) and not isinstance(values[0], (list, dict))):
+        raise InvalidQuery("Invalid cursor %s" % cursor)
+    return values
+
+
+def parse_filter(name: str, value: str) -> tuple:
+    """
+    Splits a query parameter like price__gte=10 into selector name, lookup and value
+    >>> parse_filter("price__gte", "10"), parse_filter("title", "a")
+    (('price', 'gte', '10'), ('title', 'exact', 'a'))
+    """
+    name, _, lookup = name.partition("__")
+    return name, lookup or "exact", value
+
+
+def cast(spec, value: str):
+    """ Converts a filter value of a query string to the type of the selector's stored values """
+    try:
+        return {Selector.INTEGER: int, Selector.FLOAT: float}.get(spec.type, str)(value)
+    except ValueError:
+        raise InvalidQuery("Invalid value %s for %s" % (value, spec.name))
+
+
+def page(task, columns: 'list[str]'=None, sort: str=None, filters: 'list[tuple]'=(), cursor: str=None, limit: int=50) -> dict:
+    """
+    Returns up to `limit` results of a task as rows of the values of `columns` (all selectors by default, "key" for the result key).
+    Results are sorted by the key or by the selector `sort` ("-name" for descending order), filtered by (name, lookup, value) `filters`
+    and continued after `cursor`. The next cursor is None on the last page.
+    Since pages start at the cursor instead of skipping rows, every page takes the same time
+    """
+    specs = {spec.name: spec for spec in task.schema.specs}
+    columns = list(columns or task.schema.names)
+    for name in columns:
+        if name not in specs and name != "key":
+            raise InvalidQuery("Unknown column %s" % name)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    results = task.results.all()
+    for i, (name, lookup, value) in enumerate(filters):
+        if name not in specs:
+            raise InvalidQuery("Unknown column %s" % name)
+        if lookup not in LOOKUPS:
+            raise InvalidQuery("Unknown lookup %s" % lookup)
+        results = results.alias(**{"filter%s" % i: JsonValue(name)}).filter(**{"filter%s__%s" % (i, lookup): cast(specs[name], value)})
+
+    descending = bool(sort) and sort.startswith("-")
+    sort = sort.lstrip("-") if sort else None
+    if sort and sort not in specs:
+        raise InvalidQuery("Unknown column %s" % sort)
+    if sort:
+        results = results.alias(sort=JsonValue(sort))
+        # Missing values come first in ascending and last in descending order #
+        order = [F("sort").desc(nulls_last=True), "-key"] if descending else [F("sort").asc(nulls_first=True), "key"]
+    else:
+        order = ["-key"] if descending else ["key"]
+
+    if not cursor:
+        conditions = [Q()]
+    elif sort:
+        conditions = after(decode_cursor(cursor), descending)
+    else:
+        conditions = [Q(**{"key__lt" if descending else "key__gt": decode_cursor(cursor, length=1)[0]})]
+
+    values = [F("key") if name == "key" else JsonValue(name) for name in columns]
+    results = results.order_by(*order).values_list("key", *([JsonValue(sort)] if sort else []), *values)
+    rows = []
+    for condition in conditions:
+        if len(rows) > limit:
+            break
+        rows += results.filter(condition)[:limit + 1 - len(rows)]
+    offset = 2 if sort else 1
+    next_cursor = encode_cursor(list(reversed(rows[limit - 1][:offset]))) if len(rows) > limit else None
+    return dict(columns=columns, rows=[list(row[offset:]) for row in rows[:limit]], next=next_cursor)
+
+
+def after(position: list, descending: bool) -> 'list[Q]':
+    """
+    The conditions for the rows after the (sort value, key) position, in order. Missing values are queried separately,
+    so that the range on the sort value can use the selector's index
+    """
+    value, key = position
+    if descending:
+        if value is None:
+            return [Q(sort__isnull=True, key__lt=key)]
+        return [Q(sort__lte=value) & (Q(sort__lt=value) | Q(key__lt=key)), Q(sort__isnull=True)]
+    if value is None:
+        return [Q(sort__isnull=True, key__gt=key), Q(sort__isnull=False)]
+    return [Q(sort__gte=value) & (Q(sort__gt=value) | Q(key__gt=key))]
@@ -0,0 +1,102 @@
+""" Batched storage of results """
+__author__ = 'Sebastian Hofstetter'
+
+import collections
+import json
+import time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from idpscraper.models import Result, ResultChange, TaskStats
+
+
+class ResultWriter:
+    """
+    Collects results and writes them in batches of `batch_size` results or at least every `interval` seconds.
+    Every batch is a single upsert on the result key inside one transaction. Within a batch the last result of a key wins, as with single saves.
+    Written results are stamped with the time and the run that wrote them. The keys of new and updated results are collected in `inserted` and `updated`.
+    Results that are still there, but were not parsed again (e.g. of unchanged pages), are only stamped by `touch`.
+    With `track_changes`, every value that differs from the stored value of an updated result is recorded as ResultChange
+    """
+
+    def __init__(self, batch_size: int=500, interval: float=5, run=None, track_changes: bool=False, clock=time.monotonic):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.run = run
+        self.track_changes = track_changes
+        self.clock = clock
+        self.batch = {}  # key => result
+        self.touched = set()  # keys of results that are only stamped
+        self.flushed = clock()
+        self.inserted = set()
+        self.updated = set()
+
+    def __len__(self):
+        return len(self.batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def add(self, results: 'list[Result]'):
+        """ Schedule results for writing """
+        for result in results:
+            result.pack()
+            self.batch[result.key] = result
+        if self.due():
+            self.flush()
+
+    def touch(self, keys):
+        """ Schedule stamping the existing results with the given keys as seen by the run """
+        self.touched.update(keys)
+        if self.due():
+            self.flush()
+
+    def due(self) -> bool:
+        """ Whether the batch is full or the interval has passed """
+        return len(self.batch) + len(self.touched) >= self.batch_size or self.clock() - self.flushed >= self.interval
+
+    def flush(self):
+        """ Write all collected results """
+        self.flushed = self.clock()
+        if not self.batch and not self.touched:
+            return
+        now = timezone.now()
+        touched = list(self.touched - self.batch.keys())
+        for result in self.batch.values():
+            result.first_seen = result.last_seen = now  # The first stamps are only written for new results
+            result.first_run = result.last_run = self.run
+        Task = Result._meta.get_field("task").related_model
+        with transaction.atomic():
+            # Write first: on SQLite, a transaction that reads first fails instead of waiting, if another run writes concurrently #
+            for i in range(0, len(touched), self.batch_size):
+                Result.objects.filter(key__in=touched[i:i + self.batch_size]).update(last_seen=now, last_run=self.run)
+            existing = set()
+            if self.batch:
+                Task.bump_version(*{result.task_id for result in self.batch.values()})
+                if self.track_changes:
+                    existing = {key: result.results for key, result in Result.objects.only("key", "results").in_bulk(self.batch.keys()).items()}
+                    ResultChange.objects.bulk_create(self.changes(existing, now), batch_size=self.batch_size)
+                else:
+                    existing = Result.objects.only("key").in_bulk(self.batch.keys())
+                existing = existing.keys()
+                Result.objects.bulk_create(self.batch.values(), batch_size=self.batch_size, update_conflicts=True, unique_fields=["key"],
+                                           update_fields=["task", "results", "last_seen", "last_run"])
+                TaskStats.add_results(collections.Counter(self.batch[key].task_id for key in self.batch.keys() - existing))
+        self.updated.update(existing - self.inserted)
+        self.inserted.update(self.batch.keys() - existing)
+        self.batch = {}
+        self.touched = set()
+
+    def changes(self, existing: dict, now) -> 'list[ResultChange]':
+        """ The differences between the collected results and the `existing` values of their keys """
+        changes = []
+        for key, old_values in existing.items():
+            result = self.batch[key]
+            new_values = json.loads(json.dumps(result.results, cls=DjangoJSONEncoder))  # Compare values as they are stored
+            for field in new_values.keys() | old_values.keys():
+                if new_values.get(field) != old_values.get(field):
+                    changes.append(ResultChange(task_id=result.task_id, key=key, field=field, old=old_values.get(field), new=new_values.get(field), run=self.run, changed_at=now))
+        return changes
@@ -0,0 +1,139 @@
+""" Retry policy, error classification and per host circuit breakers for fetching urls """
+__author__ = 'Sebastian Hofstetter'
+
+import random
+import threading
+import time
+import requests
+
+
+class FetchError(Exception):
+    """ A classified error of fetching or parsing an url. Only retryable errors are worth another attempt """
+    TIMEOUT = "timeout"
+    CONNECTION = "connection"
+    SERVER = "server"  # 5xx and 429
+    CLIENT = "client"  # other 4xx
+    PARSE = "parse"
+    CIRCUIT_OPEN = "circuit open"
+    OTHER = "other"
+    RETRYABLE = (TIMEOUT, CONNECTION, SERVER)
+
+    def __init__(self, kind: str, message: str):
+        super().__init__("%s: %s" % (kind, message))
+        self.kind = kind
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in FetchError.RETRYABLE
+
+
+def classify(exception: Exception) -> FetchError:
+    """
+    Translates any exception raised while fetching or parsing into a FetchError
+    >>> classify(requests.Timeout("read timed out")).retryable
+    True
+    >>> response = requests.Response()
+    >>> response.status_code = 404
+    >>> error = classify(requests.HTTPError("not found", response=response))
+    >>> error.kind, error.retryable
+    ('client', False)
+    >>> response.status_code = 503
+    >>> classify(requests.HTTPError("unavailable", response=response)).kind
+    'server'
+    """
+    if isinstance(exception, FetchError):
+        return exception
+    if isinstance(exception, requests.Timeout):
+        return FetchError(FetchError.TIMEOUT, str(exception))
+    if isinstance(exception, requests.ConnectionError):
+        return FetchError(FetchError.CONNECTION, str(exception))
+    if isinstance(exception, requests.HTTPError) and exception.response is not None:
+        status = exception.response.status_code
+        return FetchError(FetchError.SERVER if status >= 500 or status == 429 else FetchError.CLIENT, str(exception))
+    return FetchError(FetchError.OTHER, repr(exception))
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and full jitter
+    >>> policy = RetryPolicy(max_attempts=3, backoff=1, max_backoff=3)
+    >>> policy.should_retry(FetchError(FetchError.TIMEOUT, ""), attempts=2), policy.should_retry(FetchError(FetchError.TIMEOUT, ""), attempts=3)
+    (True, False)
+    >>> policy.should_retry(FetchError(FetchError.PARSE, ""), attempts=1)
+    False
+    >>> all(0 <= policy.delay(attempts) <= 3 for attempts in range(1, 10))
+    True
+    """
+
+    def __init__(self, max_attempts: int=4, backoff: float=1, max_backoff: float=60):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, error: FetchError, attempts: int) -> bool:
+        return error.retryable and attempts < self.max_attempts
+
+    def delay(self, attempts: int) -> float:
+        """ Seconds to wait before the next attempt after `attempts` failed attempts """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempts - 1)))
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures of a host and stays open for `cooldown` seconds.
+    After the cooldown a single failure opens it again, a single success closes it.
+    >>> now = [0]
+    >>> breaker = CircuitBreaker(threshold=2, cooldown=10, clock=lambda: now[0])
+    >>> breaker.failure(); breaker.is_open()
+    False
+    >>> breaker.failure(); breaker.is_open()
+    True
+    >>> now[0] = 10; breaker.is_open()
+    False
+    >>> breaker.failure(); breaker.is_open()
+    True
+    >>> breaker.success(); breaker.is_open()
+    False
+    """
+
+    def __init__(self, threshold: int=5, cooldown: float=300, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.opened is not None and self.clock() - self.opened < self.cooldown
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = self.clock()
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """ Returns the process wide circuit breaker of a host """
+    with _lock:
+        if host not in _breakers:
+            from django.conf import settings
+            _breakers[host] = CircuitBreaker(threshold=settings.IDPSCRAPER_BREAKER_THRESHOLD, cooldown=settings.IDPSCRAPER_BREAKER_COOLDOWN)
+        return _breakers[host]
+
+
+def get_policy() -> RetryPolicy:
+    """ Returns the retry policy configured in the settings """
+    from django.conf import settings
+    return RetryPolicy(max_attempts=settings.IDPSCRAPER_MAX_ATTEMPTS, backoff=settings.IDPSCRAPER_BACKOFF, max_backoff=settings.IDPSCRAPER_MAX_BACKOFF)
@@ -0,0 +1,90 @@
+""" The model for a run of a task """
+__author__ = 'Sebastian Hofstetter'
+
+import datetime
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
+
+
+class Run(models.Model):
+    """
+    A stored execution of a task. Results remember the run that first and last wrote them.
+    Runs executed in the background are queued before they run. A task has at most one active (queued or running) run.
+    Active runs write their progress and a heartbeat periodically, runs without heartbeat are considered crashed
+    """
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+    CANCELLED = 4
+    STATE_CHOICES = (
+        (QUEUED, "queued"),
+        (RUNNING, "running"),
+        (DONE, "done"),
+        (FAILED, "failed"),
+        (CANCELLED, "cancelled")
+    )
+    ACTIVE = (QUEUED, RUNNING)
+
+    task = models.ForeignKey('Task', related_name='runs', on_delete=models.CASCADE)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+    state = models.IntegerField(choices=STATE_CHOICES, default=DONE, db_index=True)  # Runs from before background runs are done
+    progress = models.JSONField(default=dict)
+    heartbeat = models.DateTimeField(null=True)
+    cancel_requested = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        # A task has at most one queued or running run #
+        constraints = [models.UniqueConstraint(fields=["task"], condition=models.Q(state__in=(0, 1)), name="idpscraper_run_one_active_per_task")]
+
+    class AlreadyRunning(Exception):
+        """ Raised when a run is started for a task that has an active run """
+
+    def __str__(self):
+        return "%s #%s" % (self.task_id, self.pk)
+
+    def __repr__(self):
+        fields = ["task_id", "pk", "state", "started_at", "finished_at"]
+        fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
+        return "Run(%s)" % fields
+
+    @property
+    def active(self) -> bool:
+        return self.state in Run.ACTIVE
+
+    @staticmethod
+    def begin(task, state: int=RUNNING, timeout: float=600) -> 'Run':
+        """ Creates the active run of a task. Active runs without heartbeat for `timeout` seconds are marked as failed first """
+        now = timezone.now()
+        Run.objects.filter(task=task, state__in=Run.ACTIVE, heartbeat__lt=now - datetime.timedelta(seconds=timeout)).update(state=Run.FAILED, error="No heartbeat", finished_at=now)
+        try:
+            with transaction.atomic():
+                return Run.objects.create(task=task, state=state, heartbeat=now)
+        except IntegrityError:
+            raise Run.AlreadyRunning("Task %s is already running" % getattr(task, "name", task))
+
+    def beat(self, progress: dict=None) -> bool:
+        """ Writes the heartbeat and the `progress` of the run, if given. Returns whether the run has been cancelled """
+        self.heartbeat = timezone.now()
+        update = dict(heartbeat=self.heartbeat)
+        if progress is not None:
+            self.progress = update["progress"] = progress
+        Run.objects.filter(pk=self.pk).update(**update)
+        self.cancel_requested = Run.objects.filter(pk=self.pk).values_list("cancel_requested", flat=True).first() or False
+        return self.cancel_requested
+
+    def finish(self, state: int, error: str=""):
+        self.state = state
+        self.error = error
+        self.finished_at = timezone.now()
+        self.save(update_fields=["state", "error", "finished_at", "progress", "heartbeat"])
+
+    @staticmethod
+    def cancel(pk: int) -> bool:
+        """ Asks an active run to stop. Queued runs are cancelled right away. Returns whether the run was active """
+        now = timezone.now()
+        if Run.objects.filter(pk=pk, state=Run.QUEUED).update(state=Run.CANCELLED, cancel_requested=True, finished_at=now):
+            return True
+        return bool(Run.objects.filter(pk=pk, state=Run.RUNNING).update(cancel_requested=True))
@@ -0,0 +1,22 @@
+""" Return value of a task run """
+__author__ = 'Sebastian Hofstetter'
+
+import collections
+
+
+class RunResults(list):
+    """
+    The results of a task run plus statistics about the run, e.g. the number of fetched, unchanged and failed pages.
+    Stored runs also tell their Run and the keys of the results they inserted and updated
+    >>> results = RunResults([1, 2])
+    >>> results.stats["fetched"] += 1
+    >>> results, results.stats, results.inserted
+    ([1, 2], Counter({'fetched': 1}), set())
+    """
+
+    def __init__(self, results=(), run=None):
+        super().__init__(results)
+        self.stats = collections.Counter()
+        self.run = run
+        self.inserted = set()
+        self.updated = set()
@@ -1,8 +1,13 @@
 """ The model for a task's data-selector """
 __author__ = 'Sebastian Hofstetter'
 
+import threading
 from idpscraper.models import converters
+from idpscraper.models import parser
+from idpscraper.models.parser import SelectorSpec, SelectorSchema
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 
 class Selector(models.Model):
@@ -23,12 +28,7 @@ class Selector(models.Model):
         r"\d[\d.,]*",
         r"\d[\d.,:]*"
     )
-    CASTS = (
-        converters.str2int,
-        lambda x: x,
-        converters.str2datetime,
-        converters.str2float
-    )
+    CASTS = converters.CASTS
 
     task = models.ForeignKey('Task', related_name='selectors',on_delete=models.CASCADE)
     name = models.TextField()
@@ -36,6 +36,7 @@ class Selector(models.Model):
     xpath = models.TextField()
     regex = models.TextField()
     is_key = models.BooleanField(default=False)
+    indexed = models.BooleanField(default=False)  # Keep an index on the selector's values for filtering results in the database
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -49,6 +50,40 @@ class Selector(models.Model):
         return Selector.CASTS[self.type](value)
 
     def __repr__(self):
-        fields = ["task_id", "name", "type", "xpath", "regex", "is_key"]
+        fields = ["task_id", "name", "type", "xpath", "regex", "is_key", "indexed"]
         fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
-        return "Selector(%s)" % fields
\ No newline at end of file
+        return "Selector(%s)" % fields
+
+    @property
+    def spec(self) -> SelectorSpec:
+        """ The selector in a form that can be passed to parser processes """
+        return SelectorSpec(self.name, self.type, self.xpath, self.regex, self.is_key)
+
+    def validate(self):
+        """ Raises a ValueError, if the XPath or the regular expression of the selector cannot be compiled """
+        parser.validate(self.spec)
+
+
+_schemas = {}  # task name => SelectorSchema
+_lock = threading.Lock()
+
+
+def get_schema(task_name: str) -> SelectorSchema:
+    """ Returns the selectors of a task. They are queried once and shared by all results, tables and runs until the selectors change """
+    schema = _schemas.get(task_name)
+    if schema is None:
+        schema = SelectorSchema([selector.spec for selector in Selector.objects.filter(task_id=task_name).order_by("pk")])
+        with _lock:
+            _schemas[task_name] = schema
+    return schema
+
+
+def invalidate_schema(task_name: str):
+    """ Forget the selectors of a task and their compiled plan """
+    with _lock:
+        _schemas.pop(task_name, None)
+
+
+@receiver([post_save, post_delete], sender=Selector)
+def _selector_changed(sender, instance, **kwargs):
+    invalidate_schema(instance.task_id)
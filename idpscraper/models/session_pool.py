@@ -0,0 +1,62 @@
+""" Shared http session with a connection pool that survives single requests and task runs """
+__author__ = 'Sebastian Hofstetter'
+
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+
+class BlockCookies(DefaultCookiePolicy):
+    """ Neither accepts nor sends cookies """
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+class SessionPool:
+    """
+    Holds one requests session whose connections are kept alive and reused by all threads.
+    The session is shared by all tasks and runs, so it does not keep cookies. Tasks that need cookies log in with their own session
+    >>> pool = SessionPool(hosts=2, per_host=4)
+    >>> pool.session.get_adapter("https://www.immowelt.de")._pool_maxsize
+    4
+    >>> pool.session.cookies.get_policy().set_ok(None, None)
+    False
+    >>> pool.stats()
+    {'requests': 0, 'connections': 0, 'reused': 0}
+    """
+
+    def __init__(self, hosts: int=10, per_host: int=4, keep_alive: bool=True):
+        self.adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=per_host)
+        self.session = Session()
+        self.session.cookies.set_policy(BlockCookies())
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def stats(self) -> dict:
+        """ Returns how many requests have been sent over how many connections of the currently pooled hosts """
+        pools = self.adapter.poolmanager.pools
+        pools = [pool for pool in (pools.get(key) for key in pools.keys()) if pool is not None]
+        requests = sum(pool.num_requests for pool in pools)
+        connections = sum(pool.num_connections for pool in pools)
+        return dict(requests=requests, connections=connections, reused=requests - connections)
+
+
+_pool = None
+_lock = threading.Lock()
+
+
+def get() -> SessionPool:
+    """ Returns the process wide session pool, which is created on first use """
+    global _pool
+    with _lock:
+        if _pool is None:
+            from django.conf import settings
+            _pool = SessionPool(hosts=settings.IDPSCRAPER_POOL_HOSTS, per_host=settings.IDPSCRAPER_POOL_PER_HOST, keep_alive=settings.IDPSCRAPER_KEEP_ALIVE)
+        return _pool
@@ -1,22 +1,63 @@
 """ General model for a webscraping task """
 __author__ = 'Sebastian Hofstetter'
 
+import contextlib
 import itertools
-from idpscraper.models import UrlSelector, Selector, Result
-from django.db import models
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from idpscraper.models import UrlSelector, Selector, Result, FrontierUrl, Page, Run, TaskStats
+from idpscraper.models import session_pool, rate_limiter, retry, http_cache, page_store, fingerprint, canonical_url, selector, columns, export_cache, events
+from idpscraper.models.bloom_filter import ScalableBloomFilter
+from idpscraper.models.fetcher import Fetcher
+from idpscraper.models.frontier import Frontier
+from idpscraper.models.parser import ParserPool, SelectorPlan, SelectorSchema
+from idpscraper.models.result_writer import ResultWriter
+from idpscraper.models.run_results import RunResults
+from django.db import models, connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.conf import settings
+from django.utils import timezone
 import logging
-from lxml import html, etree  # xpath support
 from requests import Session  # for login required http requests
-import re
-import time
-import traceback
 import datetime
+import time
+
+
+def initial_version():
+    return time.time_ns()  # A task that is created again under the same name must not reuse the versions of its predecessor
 
 
 class Task(models.Model):
     """ A Webscraper Task """
 
     name = models.TextField(primary_key=True)
+    track_changes = models.BooleanField(default=False)  # Record changed values of results as ResultChange
+    version = models.BigIntegerField(default=initial_version)  # Changes whenever results, selectors or url selectors change
+
+    @property
+    def failed_urls(self):
+        """ Returns the frontier urls that failed in the last run """
+        return self.frontier.filter(state=FrontierUrl.FAILED)
+
+    @property
+    def schema(self) -> SelectorSchema:
+        """ The names, keys and types of the task's selectors. The schema is queried once and shared until the selectors change """
+        return selector.get_schema(self.name)
+
+    @property
+    def plan(self) -> SelectorPlan:
+        """ The selectors of the task compiled for parsing. Invalid XPaths or regular expressions raise an exception """
+        return self.schema.compile()
+
+    @staticmethod
+    def bump_version(*names: str):
+        """ Mark the data of tasks as changed, which invalidates their cached exports """
+        Task.objects.filter(pk__in=names).update(version=models.F("version") + 1)
+
+    def invalidate_plan(self):
+        """ Forget the schema and the compiled selectors, e.g. after the selectors have been changed without saving them one by one """
+        selector.invalidate_schema(self.name)
 
     @property
     def recursive_url_selectors(self):
@@ -27,7 +68,7 @@ class Task(models.Model):
         return self.name
 
     def __repr__(self):
-        fields = ["name"]
+        fields = ["name", "track_changes"]
         fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
         return "Task(%s)" % fields
 
@@ -42,145 +83,454 @@ class Task(models.Model):
 
     def as_table(self, results):
         """ Prepare a set of results in a table like format, where the first row states the columns' titles """
-        yield tuple(selector.name for selector in self.selectors.all())
+        names = self.schema.names
+        yield names
 
         for result in results:
-            yield tuple(getattr(result, selector.name) if hasattr(result, selector.name) else None for selector in self.selectors.all())
-
-    def run(self, limit=None, store=True) -> 'list[Result]':
-        """ Execute a task """
-        urls = set(self.get_urls(limit=limit))
-        visited_urls = set()
-        all_results = []
-
-        while len(urls) > 0:
-            logging.info("Remaining: %s" % len(urls))
-            url = urls.pop()
-            if url not in visited_urls:
-                visited_urls.add(url)
-
-                # Fetch Result #
-                results = self.http_request(url)
-                all_results += results
+            yield tuple(getattr(result, name, None) for name in names)
+
+    def run(self, limit=None, store=True, workers=None, per_host=None, urls=None, resume=False, parsers=None, job: Run=None, budget: threading.Semaphore=None) -> 'list[Result]':
+        """
+        Execute a task. Urls are fetched concurrently by up to `workers` threads with at most `per_host` parallel requests per host.
+        Every host is rate limited by its token bucket (see IDPSCRAPER_RATE). Instead of the task's urls, a list of `urls` can be given.
+        Urls are fetched without tracking parameters and told apart by their canonical form (see canonicalize).
+        When storing, the urls of the run are kept in the task's persistent frontier: an interrupted run can be continued with `resume`
+        and several workers can resume the same run. Urls that failed even after retrying remain in the frontier as failed_urls.
+        Fetched pages are kept in the page store for reparsing. With `parsers`, pages are parsed by that many processes (see IDPSCRAPER_PARSERS).
+        When storing, pages whose fingerprint did not change since the last run are neither parsed nor stored again. Their results are only stamped as seen.
+        Fingerprints are written in the same transaction as the results of their pages, so pages of crashed runs are parsed again.
+        Stored runs are recorded as Run, which reports its progress and can be cancelled. A task has only one active run:
+        starting another one raises Run.AlreadyRunning, unless resuming, which joins the active run. A queued `job` is executed as the run.
+        Every worker waits for the urls in flight at other workers, which are handed out again if their worker crashed, and then finishes the run.
+        A worker that fails hands its urls back for resuming.
+        A `budget` limits the parallel requests of several runs together (see run_many).
+        The returned results tell the run and the keys of the results it inserted and updated
+        """
+        error_rate = settings.IDPSCRAPER_VISITED_ERROR_RATE
+        run, joined = job, False
+        if store and not run:
+            try:
+                run = Run.begin(self, timeout=settings.IDPSCRAPER_JOB_TIMEOUT)
+            except Run.AlreadyRunning:
+                run = self.runs.filter(state__in=Run.ACTIVE).first() if resume else None
+                if not run:
+                    raise
+                joined = True  # The run is finished by the worker that started it
+        live = events.get(self.name)
+        all_results = RunResults(run=run)
+        stats = all_results.stats
+        started = time.monotonic()
+        reported = started
+        frontier, fetcher = None, None
+        fingerprints = {}  # url => fingerprint of the last run, for the urls claimed but not fetched yet
+        result_keys = {}  # url => keys of the results parsed from the page by the last run, for the urls claimed but not fetched yet
+
+        def fetch(url):
+            """ Fetch an url and record its latency or error in the live events """
+            with budget or contextlib.nullcontext():
+                fetch_started = time.monotonic()
+                try:
+                    html_src = self.fetch(url)
+                except Exception as e:
+                    live.error(url, str(retry.classify(e)))
+                    raise
+                live.fetched(url, time.monotonic() - fetch_started)
+                return html_src
+
+        def claim(count: int) -> 'list[str]':
+            """ Claim urls from the frontier together with the fingerprints and result keys of their pages """
+            urls = frontier.claim(count)
+            for url, page_fingerprint, keys in self.pages.filter(url__in=urls).values_list("url", "fingerprint", "result_keys"):
+                fingerprints[url], result_keys[url] = page_fingerprint, keys
+            return urls
+
+        def progress() -> dict:
+            """ The progress of the run so far """
+            pending = (len(fetcher) if fetcher else 0) + (frontier.urls.filter(state=FrontierUrl.PENDING).count() if frontier else 0)
+            return dict(stats, pending=pending, pages_per_sec=round(stats["fetched"] / max(time.monotonic() - started, 0.001), 2))
+
+        try:  # Any failure from here on marks the run as failed
+            live.start(run.pk if run else None)
+            plan = self.plan  # Invalid selectors fail before anything is fetched
+            writer = self.result_writer(run)
+            frontier = Frontier(self, batch_size=settings.IDPSCRAPER_FRONTIER_BATCH, timeout=settings.IDPSCRAPER_FRONTIER_TIMEOUT, error_rate=error_rate, writer=writer, key=self.canonicalize) if store else None
+            fetcher = Fetcher(fetch, workers=workers or settings.IDPSCRAPER_WORKERS, per_host=per_host or settings.IDPSCRAPER_WORKERS_PER_HOST,
+                              buckets=rate_limiter.get, policy=retry.get_policy(), breakers=retry.get_breaker, feed=claim if frontier else None,
+                              visited=ScalableBloomFilter(error_rate=error_rate), key=self.canonicalize)
+
+            start_urls = map(self.strip_tracking, self.get_urls(limit=limit) if urls is None else urls)
+            if not frontier:
+                fetcher.add(start_urls)
+            elif not (resume and frontier.unfinished()):
+                frontier.reset(start_urls)
+            selectors_signature = repr(plan)  # Changed selectors require parsing again
+            failed = {}
+            pages = {}  # url => changed page, whose fingerprint is written together with its results
+            cancelled = False
+
+            def handle(url, unchanged, rows, error):
+                """ Store the parsed results of a page """
+                if error:
+                    logging.error("Failed to parse %s: %r" % (url, error))
+                    failed[url] = retry.FetchError(retry.FetchError.PARSE, repr(error))  # Broken selectors are not worth a retry
+                    live.error(url, str(failed[url]))
+                    page = pages.pop(url, None)
+                    if page:
+                        page.fingerprint = ""  # Kept for reparsing, but parsed again by the next run
+                        Page.upsert([page])
+                    return
+                results = self.to_results(rows)
 
                 if store and results:
-                    # Store result in database #
-                    for result in results:
-                        result.save()
+                    if not unchanged:
+                        writer.add(results)  # Store result in database
 
                     # Schedule new urls on recursive call #
                     if self.recursive_url_selectors:
-                        urls.update(self.recursive_url_selectors[0].get_urls(results=results))
+                        frontier.enqueue(map(self.strip_tracking, self.recursive_url_selectors[0].get_urls(results=results)))
+                        fetcher.notify()
+
+                if not unchanged:
+                    all_results.extend(results)
+                    stats["results"] += len(results)
+                    live.update(results=stats["results"])
+                if frontier:
+                    page = pages.pop(url, None)
+                    if page:
+                        page.result_keys = [result.key for result in results]
+                    frontier.done(url, page=page)
+
+            with ParserPool(plan, processes=settings.IDPSCRAPER_PARSERS if parsers is None else parsers) as parser_pool:
+                while not cancelled:
+                    for url, html_src in fetcher:
+                        logging.info("Remaining: %s" % len(fetcher))
+                        stats["fetched"] += 1
+                        stats["bytes"] += len(html_src)
+
+                        # Report progress and stop if cancelled #
+                        if run and time.monotonic() - reported >= settings.IDPSCRAPER_JOB_PROGRESS_INTERVAL:
+                            reported = time.monotonic()
+                            current = progress()
+                            live.update(pending=current["pending"])
+                            cancelled = run.beat(None if joined else current)
+                            if cancelled:
+                                break  # The page is handed out again on resume
+
+                        # Skip unchanged pages #
+                        page_fingerprint = fingerprint.fingerprint(self.normalize(html_src), salt=selectors_signature)
+                        unchanged = fingerprints.pop(url, None) == page_fingerprint
+                        keys = result_keys.pop(url, [])
+                        if unchanged:
+                            stats["unchanged"] += 1
+                            writer.touch(keys)  # The results of the page are still there
+                            if not self.recursive_url_selectors:
+                                if frontier:
+                                    frontier.done(url)
+                                continue  # Nothing to do. Otherwise the page is parsed only to schedule its urls
+                        elif frontier:
+                            pages[url] = self.page(url, html_src, page_fingerprint)
+                        else:
+                            self.store_page(url, html_src)  # Results of test runs are not stored, so neither is their fingerprint
+
+                        # Parse Result #
+                        parser_pool.submit((url, unchanged), html_src)
+                        for (parsed_url, parsed_unchanged), rows, error in parser_pool.completed():
+                            handle(parsed_url, parsed_unchanged, rows, error)
+
+                    # Pages that are still being parsed may schedule further urls #
+                    for (parsed_url, parsed_unchanged), rows, error in parser_pool.completed(block=True):
+                        handle(parsed_url, parsed_unchanged, rows, error)
+                    if frontier:
+                        frontier.flush()  # Other workers must not take the done urls of this worker as stale while it waits
+                    if not fetcher.feed or (fetcher.feed_empty and not frontier.unfinished(others=True)):
+                        break
+
+                    # Wait for the urls in flight at other workers #
+                    time.sleep(min(1, settings.IDPSCRAPER_FRONTIER_TIMEOUT))
+                    cancelled = run.beat(None if joined else progress())
+                    fetcher.notify()
+
+            # Record failed urls #
+            failed.update(fetcher.failed)
+            stats["failed"] = len(failed)
+            if failed:
+                logging.warning("Failed: %s" % len(failed))
+            if frontier:
+                frontier.flush()  # Writes the remaining results together with their pages
+            writer.flush()
+            all_results.inserted, all_results.updated = writer.inserted, writer.updated
+            stats["inserted"], stats["updated"] = len(writer.inserted), len(writer.updated)
+            if frontier:
+                for url, error in failed.items():
+                    frontier.fail(url, error, attempts=max(1, fetcher.attempts[url]))
+                if cancelled:
+                    frontier.release()  # Claimed urls are left for resuming
+        except BaseException as e:
+            live.finish("failed")
+            if frontier:
+                frontier.release()  # Claimed urls are left for resuming
+            if run and not joined:
+                run.progress = progress()
+                run.finish(Run.FAILED, error=repr(e))
+            raise
+        if run and not joined:
+            run.progress = progress()
+            run.finish(Run.CANCELLED if cancelled else Run.DONE)
+        elif run and not cancelled:
+            run.finish(Run.DONE)  # The worker that started the run may have crashed
+        live.finish("cancelled" if cancelled else "done")
+
+        logging.info("Stats: %s" % dict(stats))
+        logging.info("Connections: %s" % session_pool.get().stats())
+        return all_results
+
+    @staticmethod
+    def run_many(tasks: 'list[Task]', workers: int=None, **kwargs) -> 'dict[str, list[Result]]':
+        """
+        Execute independent tasks concurrently. Together they make at most `workers` parallel requests (see IDPSCRAPER_WORKERS),
+        which every task may use on its own while the others wait for their hosts. Further arguments are passed to run.
+        Returns the results by task name. Tasks that failed are logged and map to their exception
+        """
+        workers = workers or settings.IDPSCRAPER_WORKERS
+        budget = threading.Semaphore(workers)
+
+        def run(task):
+            try:
+                return task.run(workers=workers, budget=budget, **kwargs)
+            except Exception as e:
+                logging.exception("Run of %s failed" % task.name)
+                return e
+            finally:
+                connection.close()  # Every thread has its own connection
+
+        with ThreadPoolExecutor(max_workers=max(1, len(tasks)), thread_name_prefix="idpscraper-run-many") as executor:
+            return dict(zip([task.name for task in tasks], executor.map(run, tasks)))
+
+    def retry_failed(self) -> 'list[Result]':
+        """ Execute a task only for the urls that failed in its last run """
+        return self.run(urls=list(self.failed_urls.values_list("url", flat=True)))
+
+    def resume(self) -> 'list[Result]':
+        """ Continue an interrupted run of the task or join a run of another worker """
+        return self.run(resume=True)
+
+    def test(self) -> 'list[Result]':
+        """ Execute a task without storing the results in the database. Pages that are in the page store are reparsed instead of fetched again """
+        urls = [self.strip_tracking(url) for url in self.get_urls(limit=1)]
+        store = page_store.get()
+        pages = {page.url: page for page in self.pages.filter(url__in=urls)} if store else {}
 
+        results = []
+        missing_urls = []
+        for url in urls:
+            html_src = store.get(pages[url].content_hash) if url in pages else None
+            if html_src is None:
+                missing_urls.append(url)
+            else:
+                results += self.parse(html_src)
+        return results + (self.run(store=False, urls=missing_urls) if missing_urls else [])
+
+    def reparse(self, store=True) -> 'list[Result]':
+        """ Apply the current selectors to all stored pages of the task without fetching them again. Pages evicted from the page store are skipped """
+        pages = page_store.get()
+        if not pages:
+            return []
+
+        all_results = []
+        with self.result_writer() as writer:
+            for page in self.pages.iterator():
+                html_src = pages.get(page.content_hash)
+                if html_src is None:
+                    continue
+                results = self.parse(html_src)
+                all_results += results
+                if store:
+                    writer.add(results)
         return all_results
 
-    def test(self):
-        """ Execute a task without storing the results in the database """
-        return self.run(limit=1, store=False)
+    def result_writer(self, run: Run=None) -> ResultWriter:
+        """ Returns a writer that stores results in batches (see IDPSCRAPER_RESULT_BATCH) """
+        return ResultWriter(batch_size=settings.IDPSCRAPER_RESULT_BATCH, interval=settings.IDPSCRAPER_RESULT_INTERVAL, run=run, track_changes=self.track_changes)
+
+    @property
+    def last_run(self) -> Run:
+        """ The latest finished run of the task """
+        return self.runs.exclude(finished_at=None).order_by("-pk").first()
+
+    def new_results(self, run: Run=None):
+        """ The results that were first seen in a run, by default in the last run """
+        run = run or self.last_run
+        return run.new_results.all() if run else self.results.none()
+
+    def recent_changes(self, field: str=None, since: datetime.datetime=None, run: Run=None):
+        """ The recorded changes of the task's results, newest first. Can be restricted to a field, a point of time or a run """
+        changes = self.changes.all()
+        if field:
+            changes = changes.filter(field=field)
+        if since:
+            changes = changes.filter(changed_at__gte=since)
+        if run:
+            changes = changes.filter(run=run)
+        return changes.order_by("-changed_at", "-pk")
+
+    def store_page(self, url: str, html_src: str, page_fingerprint: str=""):
+        """ Remember the fingerprint of a fetched page and keep its source in the page store, if it is enabled """
+        Page.upsert([self.page(url, html_src, page_fingerprint)])
+
+    def page(self, url: str, html_src: str, page_fingerprint: str="") -> Page:
+        """ Keeps the source of a fetched page in the page store, if it is enabled, and returns the unsaved page """
+        store = page_store.get()
+        return Page(task=self, url=url, content_hash=store.put(html_src) if store else "", fingerprint=page_fingerprint)
+
+    def canonicalize(self, url: str) -> str:
+        """ Returns the canonical form of an url without tracking parameters (see IDPSCRAPER_TRACKING_PARAMS). It identifies the url within a run """
+        return canonical_url.canonicalize(url, settings.IDPSCRAPER_TRACKING_PARAMS)
+
+    def strip_tracking(self, url: str) -> str:
+        """ Returns an url without tracking parameters (see IDPSCRAPER_TRACKING_PARAMS). This is the url that is fetched """
+        return canonical_url.strip_tracking(url, settings.IDPSCRAPER_TRACKING_PARAMS)
+
+    def normalize(self, html_src: str) -> str:
+        """ Strip volatile fragments (see IDPSCRAPER_VOLATILE_PATTERNS) from a page before it is fingerprinted """
+        return fingerprint.normalize(html_src, tuple(settings.IDPSCRAPER_VOLATILE_PATTERNS))
+
+    def delete_results(self):
+        """ Delete all results of the task. Fingerprints are reset, so that the next run parses every page again """
+        with transaction.atomic():
+            Task.bump_version(self.name)  # Together with the deletion, so that no export of the deleted results is cached for the new version
+            self.results.all().delete()
+            TaskStats.objects.filter(task=self).update(result_count=0)
+            self.pages.update(fingerprint="")
 
     def export(self):
         """ Return the python representation of the task """
         return ",\n".join([repr(m) for m in [self] + list(self.selectors.all()) + list(self.url_selectors.all())])
 
+    def cached_export(self, export_format: str, export):
+        """
+        Returns the export of the task in a format from the export cache (see IDPSCRAPER_EXPORT_CACHE_DIR) as binary file or iterator of chunks.
+        If the export is not cached for the current data version, `export` is called
+        """
+        cache = export_cache.get()
+        if not cache:
+            return export()
+        version = Task.objects.filter(pk=self.name).values_list("version", flat=True).get()
+        return cache.open(self.name, version, export_format, export)
+
+    def export_table(self):
+        """ All results of the task as table (see as_table). Results are read in chunks (see IDPSCRAPER_EXPORT_CHUNK) """
+        return self.as_table(self.results.only("task", "results").iterator(chunk_size=settings.IDPSCRAPER_EXPORT_CHUNK))
+
     def export_to_excel(self):
-        """ Return the binary excel data of the task's results """
-        return Task.export_data_to_excel(data=self.as_table(self.results.all()))
+        """ Return a temporary file with the excel data of the task's results """
+        return Task.export_data_to_excel(data=self.export_table())
+
+    def export_to_csv(self):
+        """ Yield the task's results as lines of csv. Datetimes are written in ISO format """
+        import csv
+        import io
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for row in self.export_table():
+            writer.writerow([column.isoformat() if isinstance(column, datetime.datetime) else column for column in row])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    def export_to_ndjson(self):
+        """ Yield the task's results as lines of JSON objects """
+        import json
+        from django.core.serializers.json import DjangoJSONEncoder
+
+        table = self.export_table()
+        names = next(table)
+        for row in table:
+            yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + "\n"
+
+    def to_columns(self, names: 'list[str]'=None) -> dict:
+        """
+        The values of the task's selectors as one numpy array per selector, read straight from the results column.
+        Integers and floats become numbers, datetimes datetime64 and strings objects. Without numpy, lists are returned
+        """
+        specs = [spec for spec in self.schema.specs if names is None or spec.name in names]
+        values = columns.read(self.results.all(), specs, chunk_size=settings.IDPSCRAPER_EXPORT_CHUNK)
+        try:
+            return columns.to_numpy(specs, values)
+        except ImportError:
+            return values
+
+    def to_arrow(self, names: 'list[str]'=None):
+        """ The values of the task's selectors as arrow table with typed columns. Requires pyarrow """
+        specs = [spec for spec in self.schema.specs if names is None or spec.name in names]
+        return columns.to_arrow(specs, columns.read(self.results.all(), specs, chunk_size=settings.IDPSCRAPER_EXPORT_CHUNK))
+
+    def export_to_parquet(self):
+        """ Return a temporary parquet file of the task's results, whose columns are typed by the selectors. Requires pyarrow """
+        import pyarrow  # Parquet export support
+        import pyarrow.parquet
+        import tempfile
+
+        schema = columns.arrow_schema(self.schema.specs)
+
+        output = tempfile.TemporaryFile()
+        table = self.export_table()
+        next(table)  # The schema holds the names
+        with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+            while True:
+                rows = list(itertools.islice(table, settings.IDPSCRAPER_EXPORT_CHUNK))
+                if not rows:
+                    break
+                writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(zip(*rows), schema)], schema=schema))
+        output.seek(0)
+        return output
 
     @staticmethod
-    def export_data_to_excel(data):
-        """ Return the binary excel data of the given data """
+    def export_data_to_excel(data, output=None):
+        """ Write the given rows to an excel file row by row, so that memory usage does not grow with the data. Returns the file positioned at its start """
         import xlsxwriter  # Excel export support
-        import io  # for files in memory
+        import tempfile
 
-        output = io.BytesIO()
-        w = xlsxwriter.Workbook(output, dict(in_memory=True))
+        output = output or tempfile.TemporaryFile()
+        w = xlsxwriter.Workbook(output, dict(constant_memory=True, remove_timezone=True))
         ws = w.add_worksheet("data")
         ws.set_column('A:Z', 25)  # set more appriate width
 
+        default = (ws.write, w.add_format())
         cell_types = {
-            repr(type(None)): w.add_format(),
-            repr(datetime.datetime): w.add_format(dict(num_format="DD.MM.YYYY")),
-            repr(int): w.add_format(dict(num_format="0")),
-            repr(float): w.add_format(dict(num_format="0.00")),
-            repr(str): w.add_format(dict(num_format="@")),
+            type(None): (ws.write_blank, default[1]),
+            datetime.datetime: (ws.write_datetime, w.add_format(dict(num_format="DD.MM.YYYY"))),
+            int: (ws.write_number, w.add_format(dict(num_format="0"))),
+            float: (ws.write_number, w.add_format(dict(num_format="0.00"))),
+            str: (ws.write_string, w.add_format(dict(num_format="@"))),
         }
 
         # write #
         for x, row in enumerate(data):
             for y, column in enumerate(row):
-                ws.write(x, y, column, cell_types[repr(type(column))])
+                write, cell_format = cell_types.get(type(column), default)
+                write(x, y, column, cell_format)
 
         # save #
         w.close()
         output.seek(0)
-        return output.read()
+        return output
 
     def parse(self, html_src: str) -> 'list[Result]':
-        """ Parses an html document for a given XPath expression. Any resulting node can optionally be filtered against a regular expression """
-
-        # In the following some xpath extension functions are introduced. They can be used in the xpath fields of a task's selectors #
-        def textify(node):
-            return (str(node.text) if hasattr(node, "text") else str(node)).strip()
-
-        def merge_lists(context, *args):
-            """ Merge the items of lists at same positions. If one list is shorter, its last element is repeated """
-            try:
-                return [" ".join([textify(arg[min(i, len(arg) - 1)]) for arg in args]) for i in range(max(map(len, args)))]
-            except Exception as e:
-                return [""]
-
-        def exe(context, nodes, path):
-            """ Executes a given xpath with each node in the first xpath as context node """
-            try:
-                return [textify(node.xpath(path).pop()) if node.xpath(path) else "" for node in nodes]
-            except Exception as e:
-                return [""]
-
-        def all(context, nodes):
-            return [" ".join(textify(node) for node in nodes)]
-
-        ns = etree.FunctionNamespace(None)
-        ns['merge_lists'] = merge_lists
-        ns['exe'] = exe
-        ns['all'] = all
-
-        if not self.selectors.all():
+        """ Parses an html document for the XPath expressions of the task's selectors. Any resulting node can optionally be filtered against a regular expression """
+        plan = self.plan
+        if not plan:
             return html_src  # nothing to do
 
-        parsed_tree = html.document_fromstring(html_src)
-
-        selectors_results = []
-        for selector in self.selectors.all():
-            nodes = parsed_tree.xpath(selector.xpath)
-            nodes = [textify(node) for node in nodes]
-
-            if selector.regex:
-                # Apply regex to every single node #
-                selector_results = []
-                for node in nodes:
-                    node = str(node)
-                    regex_result = re.search(selector.regex, node, re.DOTALL | re.UNICODE)
-                    if regex_result:
-                        if regex_result.groups():
-                            selector_results += [regex_result.groups()[-1]]
-                        else:
-                            selector_results += [regex_result.group()]
-                    else:
-                        selector_results += [None]
-            else:
-                selector_results = nodes
-
-            selector_results = [selector.cast(data) if data is not None else None for data in selector_results]  # cast to type
+        return self.to_results(plan.parse(html_src))
 
-            selectors_results.append(selector_results)
-
-        # convert selector results from a tuple of lists to a list of tuples #
+    def to_results(self, rows: 'list[dict]') -> 'list[Result]':
+        """ Turn parsed rows into results. Rows without a complete key are dropped """
         results = []
-        for y in range(max([len(selectors_results[list(self.selectors.all()).index(key_selector)]) for key_selector in self.selectors.all() if key_selector.is_key])):  # Take as many results, as there are results for a key selector
+        for row in rows:
             result = Result(task_id=self.name)
-            for x, selector in enumerate(self.selectors.all()):
-                selectors_results[x] = selectors_results[x] or [None]  # Guarantee that an element is there
-                setattr(result, selector.name, selectors_results[x][min(y, len(selectors_results[x]) - 1)])
+            for name, value in row.items():
+                setattr(result, name, value)
 
             result.key = result.get_key()
             if result.key:
@@ -200,19 +550,31 @@ class Task(models.Model):
         return session
 
     def http_request(self, url: str, session: Session=None) -> 'list[Result]':
-        """ Returns the response of an http get-request to a given url """
-        success = False
-
-        while not success:
-            try:
-                logging.info("Requested %s" % url)  # For Debugging purposes
-                session = session or Session()
-                html_src = session.get(url, timeout=120).text
-                parsing = self.parse(html_src)
-                success = True
-                time.sleep(0.3)  # Do not DOS the server!
-            except Exception as e:
-                traceback.print_exc()
-                time.sleep(5)
-
-        return parsing
+        """ Returns the parsed response of an http get-request to a given url """
+        return self.parse(self.fetch(url, session=session))
+
+    def fetch(self, url: str, session: Session=None) -> str:
+        """
+        Returns the response body of an http get-request to a given url. Http error codes are raised, retrying is up to the caller.
+        Without a session, the shared connection pool and the http cache are used: cached pages are revalidated by a conditional get-request.
+        Safe to be called from multiple threads
+        """
+        logging.info("Requested %s" % url)  # For Debugging purposes
+        cache = http_cache.get() if session is None else None  # Pages of login sessions are private
+        cached = cache.get(url) if cache else None
+        session = session or session_pool.get().session
+        response = session.get(url, timeout=120, headers=cached.validators if cached else None)
+
+        if cached and response.status_code == 304:
+            return cached.text  # Not modified
+
+        response.raise_for_status()
+        if cache:
+            cache.store(url, response)
+        return response.text
+
+
+@receiver([post_save, post_delete], sender=Selector)
+@receiver([post_save, post_delete], sender=UrlSelector)
+def _definition_changed(sender, instance, **kwargs):
+    Task.bump_version(instance.task_id)
@@ -0,0 +1,72 @@
+""" The model for the statistics of a task, maintained while results are written and runs finish """
+__author__ = 'Sebastian Hofstetter'
+
+from django.db import models
+from django.db.models.signals import post_save, post_migrate
+from django.dispatch import receiver
+from idpscraper.models import Run, Result
+
+
+class TaskStats(models.Model):
+    """
+    Number of results and figures of the last finished run of a task. The counts are updated incrementally,
+    so that listing tasks does not count their results. Results deleted other than by Task.delete_results require a `recount`
+    """
+    task = models.OneToOneField('Task', primary_key=True, related_name='stats', on_delete=models.CASCADE)
+    result_count = models.BigIntegerField(default=0)
+    last_run_at = models.DateTimeField(null=True)
+    last_run_duration = models.FloatField(null=True)  # seconds
+    last_run_state = models.IntegerField(choices=Run.STATE_CHOICES, null=True)
+    last_run_fetched = models.IntegerField(default=0)
+    last_run_failed = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "%s: %s results" % (self.task_id, self.result_count)
+
+    def __repr__(self):
+        fields = ["task_id", "result_count", "last_run_at", "last_run_duration", "last_run_state", "last_run_fetched", "last_run_failed"]
+        fields = ", ".join(["%s=%s" % (f, repr(getattr(self, f))) for f in fields])
+        return "TaskStats(%s)" % fields
+
+    @property
+    def error_rate(self) -> float:
+        """ The share of the urls of the last run that failed """
+        attempted = self.last_run_fetched + self.last_run_failed
+        return self.last_run_failed / attempted if attempted else None
+
+    @staticmethod
+    def add_results(counts: 'dict[str, int]'):
+        """ Adds the numbers of new results of tasks. Tasks without statistics so far get their results counted once """
+        for task_id, count in counts.items():
+            if not TaskStats.objects.filter(task_id=task_id).update(result_count=models.F("result_count") + count):
+                TaskStats.recount(task_id)
+
+    @staticmethod
+    def recount(task_id: str):
+        """ Counts the results of a task from scratch """
+        stats = TaskStats(task_id=task_id, result_count=Result.objects.filter(task_id=task_id).count())
+        TaskStats.objects.bulk_create([stats], update_conflicts=True, unique_fields=["task"], update_fields=["result_count"])  # A single statement, see ResultWriter.flush
+
+    @staticmethod
+    def record_run(run: Run):
+        """ Stores the figures of a finished run as the last run of its task """
+        progress = run.progress or {}
+        figures = dict(last_run_at=run.started_at, last_run_duration=(run.finished_at - run.started_at).total_seconds(), last_run_state=run.state,
+                       last_run_fetched=progress.get("fetched", 0), last_run_failed=progress.get("failed", 0))
+        if not TaskStats.objects.filter(task_id=run.task_id).update(**figures):
+            TaskStats.recount(run.task_id)
+            TaskStats.objects.filter(task_id=run.task_id).update(**figures)
+
+
+@receiver(post_save, sender=Run)
+def _run_saved(sender, instance, **kwargs):
+    if instance.finished_at and not instance.active:
+        TaskStats.record_run(instance)
+
+
+@receiver(post_migrate)
+def _migrated(sender, app_config, **kwargs):
+    if app_config.name == "idpscraper":
+        Task = TaskStats._meta.get_field("task").related_model
+        for task_id in Task.objects.filter(stats__isnull=True).values_list("name", flat=True):
+            TaskStats.recount(task_id)  # Tasks from before the statistics
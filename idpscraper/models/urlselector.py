@@ -1,6 +1,8 @@
 """ The model for a task's URL-Selector """
 __author__ = 'Sebastian Hofstetter'
 
+from idpscraper.models.selector import get_schema
+from idpscraper.models.result import Result
 from django.db import models
 
 
@@ -36,7 +38,11 @@ class UrlSelector(models.Model):
 
     def get_url_parameters(self, results: 'list[Result]'=None, limit=None) -> 'list[str]':
         """ Retrieves the placeholder values of a dynamic url based on a list of results """
-        results = results or self.selector_task.results.all()
+        names = get_schema(self.selector_task_id).names
+        if self.selector_name not in names or self.selector_name2 not in names:
+            return  # The results cannot contain the placeholder values
+
+        results = results or Result.objects.filter(task_id=self.selector_task_id)
 
         if limit:
             results = results[:limit]
@@ -0,0 +1,21 @@
+""" Entry points of parser processes. They live outside of the models package, because the models can only be imported once django is set up """
+__author__ = 'Sebastian Hofstetter'
+
+import os
+import django
+
+plan = None  # The selector plan of the task this process parses for
+
+
+def init(specs: 'list[tuple]'):
+    """ Sets up django in a freshly started parser process and compiles the selector plan of its task """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "idp.settings")
+    django.setup()
+    from idpscraper.models.parser import SelectorPlan, SelectorSpec
+    global plan
+    plan = SelectorPlan([SelectorSpec(*spec) for spec in specs])
+
+
+def parse(html_src: str) -> 'list[dict]':
+    """ Parses a page with the selector plan of the process """
+    return plan.parse(html_src)
@@ -28,29 +28,123 @@ $.ajaxSetup({
 });
 function save(name, callback) {
     if (callback === void 0) { callback = DEFAULT; }
+    /* Returns whether the task has been saved. Invalid selectors are reported instead */
+    var saved = false;
     $.ajax({
         type: "POST",
         url: "/idpscraper/save_task/" + name,
         data: $('#task_form').serialize(),
-        success: callback,
+        success: function (data) {
+            saved = true;
+            callback(data);
+        },
+        error: function (xhr) {
+            $.web2py.flash(xhr.responseJSON ? xhr.responseJSON.results : xhr.statusText);
+        },
         async: false
     });
+    return saved;
 }
+var job = null;
 function run(name) {
-    save(name);
+    if (!save(name)) {
+        return;
+    }
     $.ajax({
         type: "POST",
         url: "/idpscraper/run_task/" + name,
-        success: function () {
-            window.location.reload();
+        dataType: "json",
+        success: function (data) {
+            job = data.job;
+            follow_job();
+        },
+        error: function (xhr) {
+            $.web2py.flash(xhr.responseJSON ? xhr.responseJSON.results : xhr.statusText);
+        }
+    });
+}
+function follow_job() {
+    /* Wait until the current run is finished. Its live metrics are shown by watch */
+    $.ajax({
+        type: "GET",
+        url: "/idpscraper/job_progress/" + job,
+        dataType: "json",
+        success: function (data) {
+            if (data.active) {
+                setTimeout(follow_job, 1000);
+            }
+            else if (data.state == "done") {
+                window.location.reload();
+            }
+            else {
+                $.web2py.flash(data.state + (data.error ? ": " + data.error : ""));
+            }
         }
     });
 }
+function cancel_job() {
+    if (job !== null) {
+        $.ajax({
+            type: "POST",
+            url: "/idpscraper/cancel_job/" + job
+        });
+    }
+}
+function watch(name) {
+    /* Show the live metrics of the runs of a task, which the server sends as events */
+    if (typeof EventSource === "undefined") {
+        return;
+    }
+    var source = new EventSource("/idpscraper/task_events/" + name);
+    source.addEventListener("metrics", function (event) {
+        var metrics = JSON.parse(event.data);
+        var recent = $.map(metrics.recent, function (item) {
+            return $("<div>").text(item.url + (item.error ? " " + item.error : " " + item.latency + "s")).html();
+        });
+        $("#live_metrics").html(metrics.state + ": " + metrics.pages_per_sec + " pages/s, " + metrics.total_fetched + " fetched, " +
+            metrics.errors + " errors, " + (metrics.latency === null ? "-" : metrics.latency + "s") + " latency, " +
+            metrics.results + " results, " + metrics.pending + " pending<br>" + recent.join("<br>"));
+    });
+}
+var results_sort = "";
+var results_cursor = null;
+function load_results(name, append) {
+    /* Load a page of results into the results table. Otherwise the table starts over with the current filter and sort order */
+    var query = $("#result_filter").val();
+    var parameters = (query ? query + "&" : "") + $.param({sort: results_sort, cursor: append && results_cursor ? results_cursor : ""});
+    $.ajax({
+        type: "GET",
+        url: "/idpscraper/results/" + name + "?" + parameters,
+        dataType: "json",
+        success: function (data) {
+            if (!append) {
+                $("#results tr:not(:first)").remove();
+            }
+            $.each(data.rows, function (i, row) {
+                $("#results").append($("<tr>").append($.map(row, function (cell) {
+                    return $("<td>").text(cell === null ? "None" : cell);
+                })));
+            });
+            results_cursor = data.next;
+            $("#more_results").toggle(data.next !== null);
+        },
+        error: function (xhr) {
+            $.web2py.flash(xhr.responseJSON ? xhr.responseJSON.results : xhr.statusText);
+        }
+    });
+}
+function sort_results(name, column) {
+    /* Sort the results by a column. Sorting by the same column again reverses the order */
+    results_sort = results_sort == column ? "-" + column : column;
+    load_results(name, false);
+}
 function export_excel(name) {
     window.location.href = "/idpscraper/export_excel/" + name + ".xlsx";
 }
 function test(name) {
-    save(name);
+    if (!save(name)) {
+        return;
+    }
     $.ajax({
         type: "GET",
         url: "/idpscraper/test_task/" + name,
@@ -150,6 +244,7 @@ function remove_url_selector() {
 function add_content_selector() {
     $("#content_selectors").append($(".content_selector").last().clone());
     $("input[name=selector_is_key]").last().val(parseInt($("input[name=selector_is_key]").eq(-2).val()) + 1);
+    $("input[name=selector_indexed]").last().val(parseInt($("input[name=selector_indexed]").eq(-2).val()) + 1);
 }
 function remove_content_selector() {
     if ($(".content_selector").length > 1)
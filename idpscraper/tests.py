@@ -1,10 +1,837 @@
+import collections
+import datetime
 import doctest
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import types
+import unittest
+from unittest import mock
+import zipfile
+import requests
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from idpscraper import models
+from idpscraper.models import Task, Selector, UrlSelector, Result, Run, FrontierUrl, TaskStats, result_index, result_pages, columns, export_cache, events, page_store, jobs
+from idpscraper.models import fetcher, http_cache, session_pool
+from idpscraper.models.disk_cache import DiskCache
+from idpscraper.models.result import JsonValue
+from idpscraper.models.frontier import Frontier
+from idpscraper.models.result_writer import ResultWriter
 
 
 def load_tests(loader, tests, ignore):
     modules = [m for m in models.__dict__.values() if isinstance(m, types.ModuleType)]
     for m in modules:
         tests.addTests(doctest.DocTestSuite(m))
-    return tests
\ No newline at end of file
+    return tests
+
+
+class SelectorQueriesTest(TestCase):
+    """ The selectors of a task are queried once, no matter how many results are handled """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i/text()")
+        self.url_selector = UrlSelector.objects.create(task=self.task, url="http://localhost/%s", selector_task=self.task, selector_name="id", selector_name2="id")
+
+    def save_results(self, count):
+        for result in self.task.to_results([dict(id=x, title="title %s" % x) for x in range(1, count + 1)]):
+            result.save()
+
+    def assertConstantQueries(self, function):
+        self.task.invalidate_plan()
+        with self.assertNumQueries(1 + 1):  # selectors and results
+            function(10)
+        self.task.invalidate_plan()
+        with self.assertNumQueries(1 + 1):
+            function(100)
+
+    def test_save(self):
+        for count in [10, 100]:
+            Result.objects.all().delete()
+            self.task.invalidate_plan()
+            with CaptureQueriesContext(connection) as queries:
+                self.save_results(count)
+            self.assertEqual(Result.objects.count(), count)
+            self.assertEqual(len([query for query in queries if "idpscraper_selector" in query["sql"]]), 1)
+
+    def test_as_table(self):
+        self.save_results(100)
+        self.assertConstantQueries(lambda count: list(self.task.as_table(self.task.results.all()[:count])))
+
+    def test_get_urls(self):
+        self.save_results(100)
+        self.assertConstantQueries(lambda count: list(self.url_selector.get_urls(limit=count)))
+
+    def test_selector_changes(self):
+        self.assertEqual(self.task.schema.names, ("id", "title"))
+        Selector.objects.create(task=self.task, name="price", type=Selector.FLOAT, xpath="//u/text()")
+        self.assertEqual(self.task.schema.names, ("id", "title", "price"))
+
+    def test_invalid_selectors(self):
+        """ Only parsing needs compiled selectors """
+        Selector.objects.create(task=self.task, name="price", type=Selector.FLOAT, xpath="//u[")
+        self.task.to_results([dict(id=1, title="title", price=1.5)])[0].save()
+        self.assertEqual(self.client.get("/idpscraper/task/task").status_code, 200)
+        with self.assertRaises(SyntaxError):  # including XPathSyntaxError
+            self.task.run(store=False, urls=[])
+
+        data = {"selector_name[]": ["id", "title"], "selector_xpath[]": ["//b/text()", "//i["], "selector_type[]": ["0", "1"], "selector_regex[]": ["", ""], "selector_is_key": ["0"]}
+        response = self.client.post("/idpscraper/save_task/task", data)
+        self.assertEqual((response.status_code, json.loads(response.content)), (400, {"results": "Invalid XPath of selector title: Invalid expression"}))
+        self.assertEqual(self.task.schema.names, ("id", "title", "price"))  # Nothing saved
+
+
+class ResultWriterTest(TestCase):
+    """ Results are upserted in batches """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i/text()")
+        self.task.invalidate_plan()
+
+    def results(self, title, count):
+        return self.task.to_results([dict(id=x, title=title) for x in range(1, count + 1)])
+
+    def test_upsert(self):
+        with ResultWriter(batch_size=100, interval=60) as writer:
+            writer.add(self.results("old", 50))
+        with ResultWriter(batch_size=100, interval=60) as writer:
+            writer.add(self.results("new", 90))
+            writer.add(self.results("newer", 10))
+            self.assertEqual(Result.objects.count(), 50)  # Nothing written before the batch is full
+        self.assertEqual(Result.objects.count(), 90)
+        self.assertEqual(Result.objects.get(key="task5").title, "newer")
+        self.assertEqual(Result.objects.get(key="task50").title, "new")
+
+    def test_batches(self):
+        writer = ResultWriter(batch_size=100, interval=60)
+        writer.add(self.results("title", 10))  # selectors
+        with CaptureQueriesContext(connection) as queries:
+            writer.add(self.results("title", 100))
+        self.assertEqual(len([query for query in queries if query["sql"].startswith('INSERT INTO "idpscraper_result"')]), 1)
+        self.assertEqual(len(writer), 0)
+
+
+class JsonResultsTest(TestCase):
+    """ Results are stored as JSON and can be filtered in the database """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="date", type=Selector.DATETIME, xpath="//i/text()")
+        Selector.objects.create(task=self.task, name="price", type=Selector.FLOAT, xpath="//u/text()", indexed=True)
+        with ResultWriter() as writer:
+            writer.add(self.task.to_results([dict(id=x, date=datetime.datetime(2018, 1, x), price=x * 1.5) for x in range(1, 21)]))
+
+    def test_values(self):
+        result = Result.objects.get(key="task3")
+        self.assertEqual((result.id, result.date, result.price), (3, datetime.datetime(2018, 1, 3), 4.5))
+        with self.assertRaises(AttributeError):
+            result.missing
+
+    def test_filter(self):
+        results = self.task.results.alias(price=JsonValue("price"), id=JsonValue("id")).filter(price__gte=15, id__in=[1, 10, 11])
+        self.assertEqual(sorted(result.id for result in results), [10, 11])
+
+    def test_indexes(self):
+        query = self.task.results.alias(price=JsonValue("price")).filter(price__gte=15)
+        sql, params = query.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = str(cursor.fetchall())
+        self.assertIn(result_index.index("price").name, plan)
+
+        Selector.objects.filter(name="price").update(indexed=False)
+        result_index.sync()
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, Result._meta.db_table)
+        self.assertNotIn(result_index.index("price").name, indexes)
+        self.assertIn(result_index.index("id").name, indexes)
+
+    def test_save_task(self):
+        """ Replacing the selectors of a task keeps the indexes of selectors that are saved again """
+        data = {"selector_name[]": ["id", "date", "price"], "selector_xpath[]": ["//b/text()", "//i/text()", "//u/text()"], "selector_type[]": ["0", "2", "3"],
+                "selector_regex[]": ["", "", ""], "selector_is_key": ["0"], "selector_indexed": ["2"]}
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post("/idpscraper/save_task/task", data).status_code, 200)
+        self.assertEqual([query["sql"] for query in queries if "INDEX" in query["sql"]], [])
+        data["selector_indexed"] = []
+        self.client.post("/idpscraper/save_task/task", data)
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, Result._meta.db_table)
+        self.assertNotIn(result_index.index("price").name, indexes)
+
+
+class RunTrackingTest(TestCase):
+    """ Results remember the runs that inserted and updated them """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+
+    def write(self, ids):
+        run = Run.objects.create(task=self.task)
+        with ResultWriter(run=run) as writer:
+            writer.add(self.task.to_results([dict(id=x) for x in ids]))
+        run.finished_at = run.started_at
+        run.save()
+        return run, writer
+
+    def test_new_results(self):
+        first, writer = self.write(range(1, 11))
+        self.assertEqual(len(writer.inserted), 10)
+        second, writer = self.write(range(5, 16))
+        self.assertEqual((sorted(writer.inserted), len(writer.updated)), (["task%s" % x for x in range(11, 16)], 6))
+
+        self.assertEqual(self.task.last_run, second)
+        self.assertEqual(sorted(result.id for result in self.task.new_results()), list(range(11, 16)))
+        self.assertEqual(self.task.new_results(first).count(), 10)
+        result = Result.objects.get(key="task5")
+        self.assertEqual((result.first_run, result.last_run), (first, second))
+        self.assertLessEqual(result.first_seen, result.last_seen)
+
+
+class ChangeTrackingTest(TestCase):
+    """ Changed values of results are recorded for tasks that track changes """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task", track_changes=True)
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="price", type=Selector.FLOAT, xpath="//i/text()")
+        Selector.objects.create(task=self.task, name="date", type=Selector.DATETIME, xpath="//u/text()")
+
+    def write(self, prices):
+        run = Run.objects.create(task=self.task)
+        with self.task.result_writer(run) as writer:
+            writer.add(self.task.to_results([dict(id=x, price=price, date=datetime.datetime(2018, 1, 1)) for x, price in enumerate(prices, 1)]))
+        return run
+
+    def test_changes(self):
+        self.write([10, 20, 30])
+        self.assertEqual(self.task.recent_changes().count(), 0)  # New results are no changes
+        run = self.write([10, 15, 30])
+        self.assertEqual([(change.key, change.field, change.old, change.new) for change in self.task.recent_changes(run=run)], [("task2", "price", 20, 15)])
+        self.write([10, 15, 30])
+        self.assertEqual(self.task.recent_changes(field="price").count(), 1)
+
+        self.task.track_changes = False
+        self.write([11, 15, 30])
+        self.assertEqual(self.task.recent_changes().count(), 1)
+
+
+class ExportTest(TestCase):
+    """ Results are exported row by row """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="date", type=Selector.DATETIME, xpath="//i/text()")
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//u/text()")
+        with self.task.result_writer() as writer:
+            writer.add(self.task.to_results([dict(id=x, date=datetime.datetime(2018, 1, 1), title=None if x % 2 else "title") for x in range(1, 101)]))
+
+    def test_excel(self):
+        with zipfile.ZipFile(self.task.export_to_excel()) as workbook:
+            sheet = workbook.read("xl/worksheets/sheet1.xml").decode()
+        self.assertEqual(sheet.count("<row "), 101)
+
+    def test_csv(self):
+        lines = list(self.task.export_to_csv())
+        self.assertEqual(len(lines), 101)
+        self.assertEqual(lines[0], "id,date,title\r\n")
+        self.assertIn("2,2018-01-01T00:00:00,title\r\n", lines)
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.task.export_to_ndjson()]
+        self.assertEqual(len(rows), 100)
+        self.assertIn(dict(id=1, date="2018-01-01T00:00:00", title=None), rows)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "requires pyarrow")
+    def test_parquet(self):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(self.task.export_to_parquet())
+        self.assertEqual((table.num_rows, table.schema.names), (100, ["id", "date", "title"]))
+
+
+class ColumnsTest(TestCase):
+    """ Results can be read as typed columns """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="rent", type=Selector.INTEGER, xpath="//i/text()")
+        Selector.objects.create(task=self.task, name="area", type=Selector.FLOAT, xpath="//i/text()")
+        Selector.objects.create(task=self.task, name="date", type=Selector.DATETIME, xpath="//u/text()")
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//s/text()")
+        with self.task.result_writer() as writer:
+            writer.add(self.task.to_results([dict(id=x, rent=x * 100 if x > 1 else None, area=x * 10.0, date=datetime.datetime(2018, 1, x), title="t%s" % x) for x in range(1, 11)]))
+
+    def test_lists(self):
+        values = columns.read(self.task.results.order_by("key"), self.task.schema.specs)
+        self.assertEqual(values["id"][:2], [1, 10])
+        self.assertEqual(values["rent"][:2], [None, 1000])
+        self.assertEqual(values["date"][0], "2018-01-01T00:00:00")
+
+    @unittest.skipUnless(importlib.util.find_spec("numpy"), "requires numpy")
+    def test_numpy(self):
+        arrays = self.task.to_columns()
+        self.assertEqual((arrays["id"].dtype.kind, arrays["rent"].dtype.kind, arrays["date"].dtype.kind, arrays["title"].dtype.kind), ("i", "f", "M", "O"))
+        self.assertEqual(sorted(arrays["id"].tolist()), list(range(1, 11)))
+        self.assertAlmostEqual(float((arrays["rent"] / arrays["area"])[arrays["id"] == 5][0]), 10.0)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "requires pyarrow")
+    def test_arrow(self):
+        table = self.task.to_arrow(["id", "date"])
+        self.assertEqual((table.num_rows, str(table.schema.field("date").type)), (10, "timestamp[us]"))
+
+
+class ExportCacheTest(TestCase):
+    """ Exports are cached until the data of their task changes """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        export_cache._cache = None
+        self.addCleanup(setattr, export_cache, "_cache", None)
+        settings = self.settings(IDPSCRAPER_EXPORT_CACHE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        self.write(range(1, 11))
+
+    def write(self, ids):
+        with self.task.result_writer() as writer:
+            writer.add(self.task.to_results([dict(id=x) for x in ids]))
+
+    def test_versions(self):
+        version = Task.get("task").version
+        self.write([11])
+        self.assertEqual(Task.get("task").version, version + 1)
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i/text()")
+        self.assertEqual(Task.get("task").version, version + 2)
+        self.task.delete_results()
+        self.assertEqual(Task.get("task").version, version + 3)
+
+    def test_direct_writes(self):
+        """ Results saved or deleted one by one invalidate the cached exports as well """
+        def export():
+            return b"".join(self.client.get("/idpscraper/export_csv/task.csv").streaming_content).splitlines()
+        self.assertEqual(len(export()), 11)
+        self.task.to_results([dict(id=11)])[0].save()
+        self.assertEqual(len(export()), 12)
+        Result.objects.get(key="task11").delete()
+        self.assertEqual(len(export()), 11)
+        self.task.delete_results()
+        self.assertEqual(len(export()), 1)
+
+    def test_etag(self):
+        response = self.client.get("/idpscraper/export_csv/task.csv")
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 11)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        response = self.client.get("/idpscraper/export_csv/task.csv", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        self.write([11])
+        response = self.client.get("/idpscraper/export_csv/task.csv", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 12)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_formats(self):
+        for url in ["/idpscraper/export_excel/task.xlsx", "/idpscraper/export_task/task.txt", "/idpscraper/export_ndjson/task.ndjson"]:
+            for _ in range(2):  # generated, then cached
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(b"".join(response.streaming_content))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+
+class TaskRunTest(TestCase):
+    """ Runs fetch, parse and store pages """
+
+    def setUp(self):
+        settings = self.settings(IDPSCRAPER_PAGE_STORE_DIR=None, IDPSCRAPER_HOST_RATES={"run": (1000, 100)})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i/text()")
+        self.urls = ["http://run/%s" % x for x in range(1, 6)]
+        self.pages = {}  # url => html
+        self.fetched = []
+        patcher = mock.patch.object(Task, "fetch", lambda task, url: self.fetched.append(url) or self.pages[url])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_canonical_urls(self):
+        url = "http://a/list?geoid=108,109&sort=2&sort=1&flag"
+        self.pages[url] = "<b>1</b><i>a</i>"
+        results = self.task.run(urls=[url, url + "&utm_source=mail", "HTTP://A:80/list?sort=2&sort=1&flag&geoid=108,109&utm_medium=x"])
+        self.assertEqual((self.fetched, len(results)), ([url], 1))
+        self.assertEqual(list(self.task.frontier.values_list("url", flat=True)), [url])
+
+    def test_skip_unchanged(self):
+        urls = self.urls
+        self.pages.update({url: "<b>%s</b><i>old</i>" % x for x, url in enumerate(urls, 1)})
+        self.assertEqual(len(self.task.run(urls=urls, parsers=0)), 5)
+        results = self.task.run(urls=urls, parsers=0)
+        self.assertEqual((len(results), results.stats["unchanged"], len(self.fetched)), (0, 5, 10))
+        self.pages[urls[2]] = "<b>3</b><i>new</i>"
+        self.assertEqual([(result.id, result.title) for result in self.task.run(urls=urls, parsers=0)], [(3, "new")])
+
+    def test_unchanged_pages_seen(self):
+        """ The results of unchanged pages are stamped as seen by the run """
+        self.pages[self.urls[0]] = "<b>1</b><b>2</b><i>old</i><i>old</i>"
+        first = self.task.run(urls=self.urls[:1], parsers=0).run
+        second = self.task.run(urls=self.urls[:1], parsers=0)
+        self.assertEqual(second.stats["unchanged"], 1)
+        self.assertEqual(set(Result.objects.values_list("first_run", "last_run")), {(first.pk, second.run.pk)})
+        self.assertTrue(all(result.last_seen > result.first_seen for result in Result.objects.all()))
+
+    def test_result_batches(self):
+        """ Claiming urls does not write the results collected so far """
+        self.pages.update({url: "<b>%s</b><i>old</i>" % x for x, url in enumerate(self.urls, 1)})
+        with self.settings(IDPSCRAPER_RESULT_BATCH=100, IDPSCRAPER_RESULT_INTERVAL=60), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.task.run(urls=self.urls, workers=1, parsers=0)), 5)  # Claims 4 urls at once
+        self.assertEqual(len([query for query in queries if query["sql"].startswith('INSERT INTO "idpscraper_result"')]), 1)
+
+    def test_parser_processes(self):
+        self.pages.update({url: "<b>%s</b><i>title %s</i>" % (x, x) for x, url in enumerate(self.urls, 1)})
+        results = self.task.run(urls=self.urls, parsers=2)
+        self.assertEqual(sorted((result.id, result.title) for result in results), [(x, "title %s" % x) for x in range(1, 6)])
+        self.assertEqual(Result.objects.count(), 5)
+
+    def test_resume_after_crash(self):
+        """ Pages whose results were lost in a crash are parsed again """
+        urls = self.urls
+        self.pages.update({url: "<b>%s</b><i>old</i>" % x for x, url in enumerate(urls, 1)})
+        to_results = Task.to_results
+        parsed = []
+
+        def crash(task, rows):
+            parsed.append(rows)
+            if len(parsed) == 4:
+                raise RuntimeError("crash")
+            return to_results(task, rows)
+        with self.settings(IDPSCRAPER_FRONTIER_BATCH=2, IDPSCRAPER_RESULT_INTERVAL=60):
+            with mock.patch.object(Task, "to_results", crash), self.assertRaises(RuntimeError):
+                self.task.run(urls=urls, parsers=0)
+            self.assertEqual(self.task.pages.count(), Result.objects.count())  # Fingerprints are only written with the results of their pages
+            self.assertLess(Result.objects.count(), 4)
+            self.task.run(urls=urls, parsers=0, resume=True)
+        self.assertEqual(Result.objects.count(), 5)
+        self.assertEqual(self.task.frontier.filter(state=FrontierUrl.DONE).count(), 5)
+
+    def test_resume_interrupted_run(self):
+        """ Urls in flight are not handed out again before the timeout. A resumed run fetches the urls that an interrupted run did not finish """
+        self.pages.update({url: "<b>%s</b><i>old</i>" % x for x, url in enumerate(self.urls, 1)})
+        first, second = Frontier(self.task), Frontier(self.task)
+        first.reset(self.urls)
+        self.assertEqual(first.claim(3), self.urls[:3])
+        self.assertEqual(second.claim(5), self.urls[3:])
+        self.assertEqual(first.claim(5), [])
+        first.done(self.urls[0])
+        first.flush()
+        first.release()  # Interrupted
+        second.release()
+        self.assertTrue(second.unfinished())
+
+        results = self.task.run(resume=True, parsers=0)
+        self.assertEqual((sorted(self.fetched), len(results)), (self.urls[1:], 4))
+        self.assertEqual(self.task.frontier.filter(state=FrontierUrl.DONE).count(), 5)
+        self.assertFalse(second.unfinished())
+
+    def join_crashed_run(self, claimed: int) -> Run:
+        """ Resumes a run whose first worker crashed after claiming `claimed` urls """
+        self.pages.update({url: "<b>%s</b><i>old</i>" % x for x, url in enumerate(self.urls, 1)})
+        run = Run.begin(self.task)
+        crashed = Frontier(self.task)
+        crashed.reset(self.urls)
+        self.assertEqual(crashed.claim(claimed), self.urls[:claimed])
+        results = self.task.run(resume=True, parsers=0)
+        run.refresh_from_db()
+        self.assertEqual((results.run, len(results)), (run, 5))
+        self.assertEqual(self.task.frontier.filter(state=FrontierUrl.DONE).count(), 5)
+        return run
+
+    def test_join_crashed_run(self):
+        self.assertEqual(self.join_crashed_run(claimed=0).state, Run.DONE)
+
+    def test_join_crashed_run_in_flight(self):
+        """ The urls in flight at the crashed worker are handed out again after the timeout """
+        with self.settings(IDPSCRAPER_FRONTIER_TIMEOUT=0.2):
+            self.assertEqual(self.join_crashed_run(claimed=2).state, Run.DONE)
+
+
+class StubSession:
+    """ Answers get-requests by a `handler`, which returns the status, body and headers of the response for an url and the request headers """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []  # (url, headers)
+
+    def get(self, url, timeout=None, headers=None):
+        self.requests.append((url, headers or {}))
+        status, body, response_headers = self.handler(url, headers or {})
+        response = requests.Response()
+        response.status_code, response._content, response.encoding, response.url = status, body.encode(), "utf-8", url
+        response.headers.update(response_headers)
+        return response
+
+
+class FetchTest(TestCase):
+    """ Runs fetch their pages through the shared session, which is stubbed here """
+
+    def setUp(self):
+        http_cache._cache = None
+        self.addCleanup(setattr, http_cache, "_cache", None)
+        settings = self.settings(IDPSCRAPER_PAGE_STORE_DIR=None, IDPSCRAPER_HTTP_CACHE_DIR=None, IDPSCRAPER_BACKOFF=0,
+                                 IDPSCRAPER_HOST_RATES={host: (1000, 100) for host in ["limit1", "limit2", "retry", "breaker"]})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i/text()")
+
+    def stub(self, handler) -> StubSession:
+        session = StubSession(handler)
+        patcher = mock.patch.object(session_pool, "get", return_value=mock.Mock(session=session))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return session
+
+    def test_per_host_limit(self):
+        active, peak, lock = collections.Counter(), collections.Counter(), threading.Lock()
+
+        def handler(url, headers):
+            url_host = fetcher.host(url)
+            with lock:
+                active[url_host] += 1
+                peak[url_host] = max(peak[url_host], active[url_host])
+            time.sleep(0.05)
+            with lock:
+                active[url_host] -= 1
+            return 200, "<b>%s</b><i>title</i>" % url.rsplit("/", 1)[1], {}
+        self.stub(handler)
+        urls = ["http://limit%s/%s" % (1 + x % 2, x) for x in range(1, 13)]
+        self.assertEqual(len(self.task.run(urls=urls, workers=8, per_host=2, parsers=0)), 12)
+        self.assertEqual(peak, {"limit1": 2, "limit2": 2})
+
+    def test_retry(self):
+        """ Server errors are retried, client errors are not """
+        attempts = collections.Counter()
+
+        def handler(url, headers):
+            attempts[url] += 1
+            if url.endswith("/2"):
+                return 404, "", {}
+            return (503, "", {}) if attempts[url] < 3 else (200, "<b>1</b><i>title</i>", {})
+        self.stub(handler)
+        results = self.task.run(urls=["http://retry/1", "http://retry/2"], parsers=0)
+        self.assertEqual((len(results), results.stats["failed"]), (1, 1))
+        self.assertEqual(attempts, {"http://retry/1": 3, "http://retry/2": 1})
+        self.assertEqual(list(self.task.frontier.filter(state=FrontierUrl.FAILED).values_list("url", "attempts")), [("http://retry/2", 1)])
+
+    def test_circuit_breaker(self):
+        """ After consecutive failures of a host, its remaining urls fail without being requested """
+        session = self.stub(lambda url, headers: (503, "", {}))
+        urls = ["http://breaker/%s" % x for x in range(1, 5)]
+        with self.settings(IDPSCRAPER_BREAKER_THRESHOLD=2, IDPSCRAPER_MAX_ATTEMPTS=1):
+            results = self.task.run(urls=urls, workers=1, parsers=0)
+        self.assertEqual((len(results), results.stats["failed"], len(session.requests)), (0, 4, 2))
+        errors = dict(self.task.frontier.values_list("url", "error"))
+        self.assertEqual([errors[url].split(":")[0] for url in urls], ["server", "server", "circuit open", "circuit open"])
+
+    def test_revalidation(self):
+        """ Cached pages are fetched by conditional requests, which are answered by 304 while the page is unchanged """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        http_cache._cache = http_cache.HttpCache(DiskCache(directory, max_size=10 ** 6))
+        etag = ['"v1"']
+        body = ["<b>1</b><i>old</i>"]
+        session = self.stub(lambda url, headers: (304, "", {}) if headers.get("If-None-Match") == etag[0] else (200, body[0], {"ETag": etag[0]}))
+        url = "http://cache/1"
+        self.assertEqual([self.task.fetch(url), self.task.fetch(url)], [body[0]] * 2)
+        self.assertEqual(session.requests, [(url, {}), (url, {"If-None-Match": '"v1"'})])
+
+        etag[0], body[0] = '"v2"', "<b>1</b><i>new</i>"
+        self.assertEqual([self.task.fetch(url), self.task.fetch(url)], ["<b>1</b><i>new</i>"] * 2)
+        self.assertEqual(session.requests[-1], (url, {"If-None-Match": '"v2"'}))
+        self.assertEqual(self.task.fetch(url, session=session), "<b>1</b><i>new</i>")  # Login sessions bypass the cache
+        self.assertEqual(session.requests[-1], (url, {}))
+
+
+class PageStoreTest(TestCase):
+    """ Stored pages are parsed again without fetching them """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        page_store._store = None
+        self.addCleanup(setattr, page_store, "_store", None)
+        settings = self.settings(IDPSCRAPER_PAGE_STORE_DIR=self.directory, IDPSCRAPER_HOST_RATES={"store": (1000, 100)})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        self.title = Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i/text()")
+        UrlSelector.objects.create(task=self.task, url="http://store/1", selector_task=self.task)
+        self.pages = {"http://store/%s" % x: "<b>%s</b><i>old</i><u>new</u>" % x for x in range(1, 4)}
+        self.fetched = []
+        patcher = mock.patch.object(Task, "fetch", lambda task, url: self.fetched.append(url) or self.pages[url])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.task.run(urls=list(self.pages), parsers=0)
+
+    def change_title(self):
+        self.title.xpath = "//u/text()"
+        self.title.save()
+        self.task.invalidate_plan()
+
+    def test_reparse(self):
+        self.change_title()
+        self.assertEqual(sorted((result.id, result.title) for result in self.task.reparse()), [(1, "new"), (2, "new"), (3, "new")])
+        self.assertEqual((len(self.fetched), Result.objects.get(key="task2").title), (3, "new"))
+
+    def test_test(self):
+        self.change_title()
+        self.assertEqual([(result.id, result.title) for result in self.task.test()], [(1, "new")])
+        self.assertEqual(len(self.fetched), 3)
+        self.pages["http://store/1"] = "<b>1</b><u>fetched</u>"
+        self.task.pages.update(content_hash="unknown")  # Pages missing in the store are fetched again
+        self.assertEqual([(result.id, result.title) for result in self.task.test()], [(1, "fetched")])
+        self.assertEqual(self.fetched[-1], "http://store/1")
+
+
+class RunJobsTest(TestCase):
+    """ Runs report their progress, can be cancelled and a task has only one active run """
+
+    def setUp(self):
+        settings = self.settings(IDPSCRAPER_PAGE_STORE_DIR=None, IDPSCRAPER_JOB_PROGRESS_INTERVAL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        patcher = mock.patch.object(Task, "fetch", lambda task, url: "<b>%s</b>" % url.rsplit("/", 1)[1])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.urls = ["http://a/%s" % x for x in range(1, 6)]
+
+    def test_guard(self):
+        run = Run.begin(self.task)
+        with self.assertRaises(Run.AlreadyRunning):
+            Run.begin(self.task)
+        with self.assertRaises(Run.AlreadyRunning):
+            self.task.run(urls=self.urls)
+        Run.objects.filter(pk=run.pk).update(heartbeat=run.heartbeat - datetime.timedelta(hours=1))
+        Run.begin(self.task, timeout=600)  # The first run crashed
+        self.assertEqual(Run.objects.get(pk=run.pk).state, Run.FAILED)
+
+    def test_progress(self):
+        run = self.task.run(urls=self.urls, workers=1).run
+        run.refresh_from_db()
+        self.assertEqual(run.state, Run.DONE)
+        self.assertEqual((run.progress["fetched"], run.progress["results"], run.progress["pending"]), (5, 5, 0))
+        self.assertGreater(run.progress["bytes"], 0)
+
+        response = json.loads(self.client.get("/idpscraper/job_progress/%s" % run.pk).content)
+        self.assertEqual((response["state"], response["active"], response["progress"]["fetched"]), ("done", False, 5))
+
+    def test_cancel(self):
+        job = Run.begin(self.task, state=Run.QUEUED)
+        self.assertTrue(json.loads(self.client.post("/idpscraper/cancel_job/%s" % job.pk).content)["cancelled"])
+        self.assertEqual(Run.objects.get(pk=job.pk).state, Run.CANCELLED)
+
+        job = Run.begin(self.task)
+        Run.cancel(job.pk)
+        self.task.run(urls=self.urls, workers=1, job=job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, Run.CANCELLED)
+        self.assertEqual(self.task.frontier.filter(state=FrontierUrl.PENDING).count(), 5)  # Left for resuming
+        self.assertEqual(len(self.task.resume()), 5)
+
+    @mock.patch.object(jobs, "connection", mock.Mock())  # The test database connection stays open
+    def test_waiting_job(self):
+        """ Queued runs that wait for a worker for longer than the timeout are not taken for crashed """
+        with mock.patch.object(jobs, "get") as pool:
+            job = jobs.submit(self.task)
+        Run.objects.filter(pk=job.pk).update(heartbeat=job.heartbeat - datetime.timedelta(hours=1))
+        jobs.beat()
+        with self.assertRaises(Run.AlreadyRunning):
+            Run.begin(self.task, timeout=600)
+        pool.return_value.submit.assert_called_once_with(jobs.execute, job.pk)
+        jobs.execute(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.state, Run.DONE)
+
+    @mock.patch.object(jobs, "connection", mock.Mock())
+    def test_failed_setup(self):
+        """ Jobs that fail before they fetch anything are marked as failed """
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//i[")
+        job = Run.begin(self.task, state=Run.QUEUED)
+        jobs.execute(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error), (Run.FAILED, "XPathSyntaxError('Invalid expression')"))
+
+        with mock.patch.object(Task, "run", side_effect=RuntimeError("broken")):
+            job = Run.begin(self.task, state=Run.QUEUED)
+            jobs.execute(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.error), (Run.FAILED, "RuntimeError('broken')"))
+
+    def test_events(self):
+        subscription = events.get("task").subscribe()
+        self.task.run(urls=self.urls, workers=1)
+        metrics = subscription.poll()
+        self.assertEqual((metrics["state"], metrics["fetched"], metrics["errors"], metrics["results"]), ("done", 5, 0, 5))
+        self.assertEqual(sorted(event["url"] for event in metrics["recent"]), self.urls)
+
+        response = self.client.get("/idpscraper/task_events/task")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        event = next(iter(response.streaming_content)).decode()
+        self.assertTrue(event.startswith("event: metrics\ndata: "))
+        self.assertEqual(json.loads(event.split("data: ", 1)[1])["total_fetched"], 5)
+
+
+class ResultPagesTest(TestCase):
+    """ Results are paged by cursors, projected, sorted and filtered in the database """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+        Selector.objects.create(task=self.task, name="price", type=Selector.FLOAT, xpath="//i/text()", indexed=True)
+        Selector.objects.create(task=self.task, name="title", type=Selector.STRING, xpath="//u/text()")
+        with self.task.result_writer() as writer:
+            writer.add(self.task.to_results([dict(id=x, price=float(x % 7) if x % 5 else None, title="t%s" % x) for x in range(1, 26)]))
+
+    def all_pages(self, **kwargs):
+        rows, cursor = [], None
+        while True:
+            page = result_pages.page(self.task, cursor=cursor, limit=4, **kwargs)
+            rows += page["rows"]
+            cursor = page["next"]
+            if not cursor:
+                return rows
+
+    def test_keys(self):
+        rows = self.all_pages(columns=["key", "id"])
+        self.assertEqual(rows, sorted([["task%s" % x, x] for x in range(1, 26)]))
+        self.assertEqual(self.all_pages(columns=["key"], sort="-id")[:2], [["task25"], ["task24"]])
+
+    def test_sort(self):
+        def expected(descending):
+            rows = sorted(([x % 7 if x % 5 else None, "task%s" % x] for x in range(1, 26)), key=lambda row: (row[0] is not None, row[0] or 0, row[1]))
+            if descending:
+                return [row for row in reversed(rows) if row[0] is not None] + [row for row in reversed(rows) if row[0] is None]
+            return rows
+        self.assertEqual(self.all_pages(columns=["price", "key"], sort="price"), expected(False))
+        self.assertEqual(self.all_pages(columns=["price", "key"], sort="-price"), expected(True))
+
+    def test_filter(self):
+        rows = self.all_pages(columns=["id"], filters=[("price", "gte", "5"), ("title", "startswith", "t1")])
+        self.assertEqual(sorted(row[0] for row in rows), [12, 13, 19])
+        with self.assertRaises(result_pages.InvalidQuery):
+            result_pages.page(self.task, filters=[("price", "regex", "1")])
+
+    def test_view(self):
+        response = json.loads(self.client.get("/idpscraper/results/task", dict(columns="id,title", sort="-id", limit=2, price__lt=2)).content)
+        self.assertEqual((response["columns"], response["rows"]), (["id", "title"], [[22, "t22"], [21, "t21"]]))
+        response = json.loads(self.client.get("/idpscraper/results/task", dict(columns="id", sort="-id", limit=2, price__lt=2, cursor=response["next"])).content)
+        self.assertEqual(response["rows"], [[14], [8]])
+        self.assertEqual(self.client.get("/idpscraper/results/task", dict(columns="nope")).status_code, 400)
+        for sort, cursor in [("id", 1), ("id", [1]), ("id", {"a": 1}), ("id", [[1], "task1"]), ("", ["task1", "task2"])]:
+            response = self.client.get("/idpscraper/results/task", dict(columns="id", sort=sort, cursor=result_pages.encode_cursor(cursor)))
+            self.assertEqual(response.status_code, 400)
+        self.assertContains(self.client.get("/idpscraper/task/task"), "t25")
+
+
+class TaskStatsTest(TestCase):
+    """ The statistics of tasks are maintained by writes and runs, so that listing tasks does not touch their results """
+
+    def setUp(self):
+        self.task = Task.objects.create(name="task")
+        Selector.objects.create(task=self.task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+
+    def write(self, ids):
+        with self.task.result_writer() as writer:
+            writer.add(self.task.to_results([dict(id=x) for x in ids]))
+
+    def test_counts(self):
+        self.write(range(1, 11))
+        self.write(range(5, 16))
+        self.assertEqual(TaskStats.objects.get(task=self.task).result_count, 15)
+        self.task.delete_results()
+        self.assertEqual(TaskStats.objects.get(task=self.task).result_count, 0)
+
+        Result.objects.all().delete()
+        self.write(range(1, 4))
+        TaskStats.objects.all().delete()
+        self.write(range(4, 6))  # counted from scratch
+        self.assertEqual(TaskStats.objects.get(task=self.task).result_count, 5)
+
+    def test_runs(self):
+        run = Run.begin(self.task)
+        run.progress = dict(fetched=9, failed=1)
+        run.finish(Run.DONE)
+        stats = TaskStats.objects.get(task=self.task)
+        self.assertEqual((stats.last_run_at, stats.last_run_state, stats.error_rate), (run.started_at, Run.DONE, 0.1))
+        self.assertGreaterEqual(stats.last_run_duration, 0)
+
+    def test_index(self):
+        self.write(range(1, 11))
+        Task.objects.create(name="other")  # without statistics
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/idpscraper/")
+        self.assertContains(response, "<td>10</td>")
+        self.assertFalse([query for query in queries.captured_queries if "idpscraper_result" in query["sql"]])
+
+
+class RunManyTest(TransactionTestCase):
+    """ Independent tasks run concurrently under a shared budget of parallel requests """
+
+    def setUp(self):
+        settings = self.settings(IDPSCRAPER_PAGE_STORE_DIR=None)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.tasks = []
+        for name in ["a", "b", "c"]:
+            task = Task.objects.create(name=name)
+            Selector.objects.create(task=task, name="id", type=Selector.INTEGER, xpath="//b/text()", is_key=True)
+            self.tasks.append(task)
+
+        lock = threading.Lock()
+        self.active, self.most_active = 0, 0
+
+        def fetch(task, url):
+            with lock:
+                self.active += 1
+                self.most_active = max(self.most_active, self.active)
+            time.sleep(0.05)
+            with lock:
+                self.active -= 1
+            if task.name == "c":
+                raise ValueError("broken")
+            return "<b>%s</b>" % url.rsplit("/", 1)[1]
+        patcher = mock.patch.object(Task, "fetch", fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_many(self):
+        urls = ["http://%s/%s" % (host, x) for host in "xyz" for x in range(1, 5)]
+        all_results = Task.run_many(self.tasks, workers=3, urls=urls, parsers=0)
+        self.assertEqual(sorted(all_results), ["a", "b", "c"])
+        self.assertEqual((len(all_results["a"]), len(all_results["b"]), all_results["c"].stats["failed"]), (12, 12, 12))
+        self.assertLessEqual(self.most_active, 3)
+        self.assertEqual(Result.objects.count(), 8)  # ids 1 to 4 of tasks a and b
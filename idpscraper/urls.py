@@ -13,7 +13,14 @@ urlpatterns = [
     path('save_task/<name>', views.save_task, name='save_task'),
     path('delete_task/<name>', views.delete_task, name='delete_task'),
     path('export_excel/<name>.xlsx', views.export_excel, name='export_excel'),
+    path('export_csv/<name>.csv', views.export_csv, name='export_csv'),
+    path('export_ndjson/<name>.ndjson', views.export_ndjson, name='export_ndjson'),
+    path('export_parquet/<name>.parquet', views.export_parquet, name='export_parquet'),
     path('run_task/<name>', views.run_task, name='run_task'),
+    path('job_progress/<int:job>', views.job_progress, name='job_progress'),
+    path('cancel_job/<int:job>', views.cancel_job, name='cancel_job'),
+    path('task_events/<name>', views.task_events, name='task_events'),
+    path('results/<name>', views.results, name='results'),
     path('run_command', views.run_command, name='run_command'),
     path('new_task', views.new_task, name='new_task'),
     path('delete_results/<name>', views.delete_results, name='delete_results'),
@@ -1,27 +1,31 @@
 """ This file contains webscraper specific views """
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponse
-from idpscraper.models import Task, Selector, UrlSelector, Result, ApartmentSettings, serialize
+from django.http import HttpResponseRedirect, HttpResponse, FileResponse, StreamingHttpResponse
+from idpscraper.models import Task, Selector, UrlSelector, Result, Run, ApartmentSettings, serialize, result_index, jobs, events, result_pages
+from idpscraper.models.result import JsonValue
 import json
 import traceback
 import datetime
 import logging
 from django.utils.timezone import utc
+from django.db.models import F
+from django.views.decorators.http import condition
 
 logging.basicConfig(level=logging.INFO)
 
 
 def index(request):
-    """ Basic view listing all existing tasks """
-    return render(request, 'idpscraper/index.html', dict(tasks=Task.objects.all()))
+    """ Basic view listing all existing tasks with their statistics """
+    return render(request, 'idpscraper/index.html', dict(tasks=Task.objects.select_related("stats").order_by("name")))
 
 
 def task(request, name):
     """ Task Details / Creation assistent """
     task = Task.get(name)
-    data = task.as_table(task.results.all()[:50])
+    page = result_pages.page(task)
+    data = [page["columns"]] + page["rows"]
     all_tasks = Task.objects.all()
-    return render(request, 'idpscraper/task.html', dict(task=task, data=data, all_tasks=all_tasks, selector_choices=Selector.TYPE_CHOICES))
+    return render(request, 'idpscraper/task.html', dict(task=task, data=data, next=page["next"], all_tasks=all_tasks, selector_choices=Selector.TYPE_CHOICES))
 
 
 def console(request):
@@ -42,32 +46,114 @@ def test_task(request, name):
 
 
 def run_task(request, name):
-    """ Execute a task and store resulting data in the database """
+    """ Queue a run of a task, which stores the resulting data in the database. Returns the id of the run for following its progress """
     try:
-        Task.get(name).run()
-        return HttpResponse(json.dumps(dict()), content_type="application/json")
+        run = jobs.submit(Task.get(name))
+        return HttpResponse(json.dumps(dict(job=run.pk)), content_type="application/json")
+    except Run.AlreadyRunning as e:
+        return HttpResponse(json.dumps(dict(results=str(e))), content_type="application/json", status=409)
     except Exception as e:
         traceback.print_exc()
         return HttpResponse(json.dumps(dict(results=str(e))), content_type="application/json")
 
 
+def job_progress(request, job):
+    """ State and progress of a run: fetched and pending urls, stored results, bytes and pages per second """
+    try:
+        run = Run.objects.get(pk=job)
+    except Run.DoesNotExist:
+        return HttpResponse(json.dumps(dict(results="Unknown job %s" % job)), content_type="application/json", status=404)
+    return HttpResponse(json.dumps(dict(job=run.pk, task=run.task_id, state=run.get_state_display(), active=run.active, progress=run.progress,
+                                        error=run.error, cancel_requested=run.cancel_requested)), content_type="application/json")
+
+
+def cancel_job(request, job):
+    """ Stop a run. Its remaining urls stay in the frontier for resuming """
+    return HttpResponse(json.dumps(dict(cancelled=Run.cancel(job))), content_type="application/json")
+
+
+def task_events(request, name):
+    """ Server-sent events with the live metrics of the runs of a task, coalesced per IDPSCRAPER_EVENTS_INTERVAL """
+    from django.conf import settings
+    stream = events.get(Task.get(name).name).subscribe().stream(interval=settings.IDPSCRAPER_EVENTS_INTERVAL)
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Proxies must not buffer the stream
+    return response
+
+
+def results(request, name):
+    """
+    A page of the results of a task as JSON: columns, rows and the cursor of the next page.
+    Parameters: columns (comma separated), sort (selector, "-selector" for descending order), cursor, limit
+    and filters on selectors like price__gte=10 (lookups: exact, gt, gte, lt, lte, contains, startswith)
+    """
+    parameters = request.GET.dict()
+    columns = [column for column in parameters.pop("columns", "").split(",") if column]
+    sort = parameters.pop("sort", None)
+    cursor = parameters.pop("cursor", None)
+    try:
+        limit = int(parameters.pop("limit", 50))
+        filters = [result_pages.parse_filter(key, value) for key, value in parameters.items()]
+        page = result_pages.page(Task.get(name), columns=columns, sort=sort, filters=filters, cursor=cursor, limit=limit)
+    except ValueError as e:  # including InvalidQuery
+        return HttpResponse(json.dumps(dict(results=str(e))), content_type="application/json", status=400)
+    return HttpResponse(json.dumps(page), content_type="application/json")
+
+
 def delete_results(request, name):
     """ Delete the all result data of a task """
-    task = Task.get(name)
-    Result.objects.filter(task=task).delete()
+    Task.get(name).delete_results()
     return HttpResponse(json.dumps(dict()), content_type="application/json")
 
 
+def export_etag(export_format):
+    """ ETags of exports change with the data version of their task """
+    def etag(request, name):
+        version = Task.objects.filter(pk=name).values_list("version", flat=True).first()
+        return None if version is None else "%s-%s" % (version, export_format)
+    return etag
+
+
+@condition(etag_func=export_etag("xlsx"))
 def export_excel(request, name):
     """ Export a task's results data to excel 2013 """
     task = Task.get(name)
-    return HttpResponse(task.export_to_excel(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    return FileResponse(task.cached_export("xlsx", task.export_to_excel), as_attachment=True, filename="%s.xlsx" % name, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+
+@condition(etag_func=export_etag("csv"))
+def export_csv(request, name):
+    """ Stream a task's results data as csv """
+    task = Task.get(name)
+    response = StreamingHttpResponse(task.cached_export("csv", task.export_to_csv), content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="%s.csv"' % name
+    return response
+
 
+@condition(etag_func=export_etag("ndjson"))
+def export_ndjson(request, name):
+    """ Stream a task's results data as JSON lines """
+    task = Task.get(name)
+    return StreamingHttpResponse(task.cached_export("ndjson", task.export_to_ndjson), content_type="application/x-ndjson")
 
+
+@condition(etag_func=export_etag("parquet"))
+def export_parquet(request, name):
+    """ Export a task's results data to parquet, if pyarrow is installed """
+    task = Task.get(name)
+    try:
+        output = task.cached_export("parquet", task.export_to_parquet)
+    except ImportError:
+        return HttpResponse("Parquet export requires pyarrow", status=501, content_type="text/plain")
+    return FileResponse(output, as_attachment=True, filename="%s.parquet" % name, content_type="application/vnd.apache.parquet")
+
+
+@condition(etag_func=export_etag("txt"))
 def export_task(request, name):
     """ Export a task specification to python """
     task = Task.get(name)
-    return HttpResponse(task.export(), content_type="text/plain")
+    return StreamingHttpResponse(task.cached_export("txt", lambda: iter([task.export()])), content_type="text/plain")
 
 
 def delete_task(request, name):
@@ -88,6 +174,23 @@ def new_task(request):
 def save_task(request, name):
     """ Takes the post request from the task form and saves the values to the task """
     task = Task.get(name)
+    selectors = [Selector(
+        task_id=name,
+        is_key=str(i) in request.POST.getlist("selector_is_key"),
+        indexed=str(i) in request.POST.getlist("selector_indexed"),
+        name=request.POST.getlist("selector_name[]")[i],
+        xpath=request.POST.getlist("selector_xpath[]")[i],
+        type=int(request.POST.getlist("selector_type[]")[i]),
+        regex=request.POST.getlist("selector_regex[]")[i],
+    ) for i in range(len(request.POST.getlist("selector_name[]")))]
+    try:
+        for selector in selectors:
+            selector.validate()
+    except ValueError as e:
+        return HttpResponse(json.dumps(dict(results=str(e))), content_type="application/json", status=400)
+
+    task.track_changes = "track_changes" in request.POST
+    task.save(update_fields=["track_changes"])
 
     UrlSelector.objects.filter(task=task).delete()
     url_selectors = [UrlSelector(
@@ -99,16 +202,11 @@ def save_task(request, name):
     ) for i in range(len(request.POST.getlist("url[]")))]
     UrlSelector.objects.bulk_create(url_selectors)
 
-    Selector.objects.filter(task=task).delete()
-    selectors = [Selector(
-        task_id=name,
-        is_key=str(i) in request.POST.getlist("selector_is_key"),
-        name=request.POST.getlist("selector_name[]")[i],
-        xpath=request.POST.getlist("selector_xpath[]")[i],
-        type=int(request.POST.getlist("selector_type[]")[i]),
-        regex=request.POST.getlist("selector_regex[]")[i],
-    ) for i in range(len(request.POST.getlist("selector_name[]")))]
-    Selector.objects.bulk_create(selectors)
+    with result_index.deferred():  # Indexes of selectors that are saved again are kept
+        Selector.objects.filter(task=task).delete()
+        Selector.objects.bulk_create(selectors)
+    task.invalidate_plan()  # bulk operations do not send signals
+    Task.bump_version(name)
 
     return HttpResponse(json.dumps(dict()), content_type="application/json")
 
@@ -215,18 +313,14 @@ def apartment_worker():
     immowelt = Task.get("immowelt.de")
     wggesucht = Task.get("wg-gesucht.de")
 
+    wohnungen = Result.objects.alias(kaltmiete=JsonValue("kaltmiete"), wohnflaeche=JsonValue("wohnflaeche"), zimmeranzahl=JsonValue("zimmeranzahl"))
+
     while True:
         apartment_settings.last_update = datetime.datetime.utcnow().replace(tzinfo=utc)
         apartment_settings.save()
-        old_wohnungen = set(wohnung.wohnungs_id for wohnung in list(immoscout.results.all()) + list(immowelt.results.all()) + list(wggesucht.results.all()))
-        new_wohnungen = set(wohnung.wohnungs_id for wohnung in immoscout.run() + immowelt.run() + wggesucht.run())
-        new_wohnungen -= old_wohnungen
-        new_wohnungen = set(wohnung for wohnung in list(immoscout.results.all()) + list(immowelt.results.all()) + list(wggesucht.results.all())
-                            if wohnung.wohnungs_id in new_wohnungen and
-                            wohnung.kaltmiete and wohnung.wohnflaeche and wohnung.kaltmiete / wohnung.wohnflaeche >= 12 and
-                            wohnung.zimmeranzahl > 1 and
-                            not getattr(wohnung, "free_until", None)
-        )
+        runs = [results.run for results in Task.run_many([immoscout, immowelt, wggesucht]).values() if not isinstance(results, Exception)]
+        new_wohnungen = set(wohnung for wohnung in wohnungen.filter(first_run__in=runs, kaltmiete__gt=0, wohnflaeche__gt=0, kaltmiete__gte=12 * F("wohnflaeche"), zimmeranzahl__gt=1)
+                            if not getattr(wohnung, "free_until", None))
 
         if new_wohnungen:
             import smtplib
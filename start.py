@@ -17,8 +17,8 @@ if __name__ == "__main__":
         import xlsxwriter
     except ImportError:
         libs = [
-            "django==2.0.1",
-            "django-picklefield==1.0.0",
+            "django==4.2.30",
+            "django-picklefield==3.4.0",
             "feedparser==5.2.1",
             "lxml==4.1.1",
             "requests==2.18.4",
@@ -36,11 +36,12 @@ if __name__ == "__main__":
 
     # Start server if no argument was given
     if len(sys.argv) == 1:
-        # Check if database and models have been initialized
-        if not os.path.exists("db.sqlite3"):
+        # Create the database or migrate it to the current models. Databases whose tables were created without these migrations are migrated as well
+        new_database = not os.path.exists("db.sqlite3")
+        if new_database:
             print("No database found. Creating tables now ...")
-            execute_from_command_line(sys.argv + ["makemigrations"])
-            execute_from_command_line(sys.argv + ["migrate"])
+        execute_from_command_line(sys.argv + ["migrate", "--fake-initial"])
+        if new_database:
             from idpscraper.views import init_apartments
             init_apartments()
             print("... Finished creating tables.")